@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+#
+# File: analysis.py
+# The analysis of a user message (tokens, language, POS tags, keywords and
+# type), which is done once per message and shared by everything that needs it
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# >>> utterance = analysis.analyze("Where is the library?")
+# >>> utterance.keywords(utterance.language)
+
+# Imports
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+
+import nltk
+
+import knowledge
+import language_detection
+from config import *
+
+# The part of speech tags of keywords
+KEYWORD_TAGS = {'NOUN', 'ADJ', 'NUM'}
+
+# The types of a sentence and the words they are recognised by
+# Hardcoded, language detection not needed
+TYPES = {1: frozenset({'wie', 'who'}),
+         2: frozenset({'what', 'wat', 'whut'}),
+         3: frozenset({'where', 'waar', 'war'}),
+         4: frozenset({'why', 'wy', 'waarom', 'wrm', 'warom', 'waarrom'}),
+         5: frozenset({'when', 'wen', 'wanneer', 'waneer', 'wanner'}),
+         6: frozenset({'how', 'hoe'}),
+         7: frozenset({'which', 'welke'})
+         }
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        """
+        A dictionary of at most maxsize items, which forgets the least
+        recently used item when it is full. It counts its hits and misses, to
+        know whether it is large enough. It can be shared by threads.
+
+        Input
+            maxsize: int greater than 0
+        """
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        """
+        Input
+            key: hashable
+            default: the value if the key is not in the cache
+        Output
+            the value of the key, or default
+        """
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Input
+            key: hashable
+            value: the value of the key
+        """
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        Output
+            dict with the 'hits', 'misses', 'size' and 'maxsize' of the cache
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self.items), 'maxsize': self.maxsize}
+
+
+# The POS tags, keywords and type of recent sentences of all sessions, by
+# normalized sentence, language and version of the knowledge base (which has
+# the stopwords)
+keyword_cache = LRUCache(KEYWORD_CACHE_SIZE)
+
+
+class Utterance:
+    def __init__(self, text):
+        """
+        A user message. Every part of the analysis is computed the first time
+        it is used, and kept.
+
+        Input
+            text: str
+        """
+        self.text = text
+        self.lowered = text.lower()
+        # Sentences that only differ in case or spacing are analyzed once
+        self.normalized = " ".join(self.lowered.split())
+        self._tokens = None
+        self._token_set = None
+        self._words = None
+        self._language = None
+        self._analyses = {}
+
+    @property
+    def tokens(self):
+        """
+        Output
+            tuple of the tokens of the lowercase text
+        """
+        if self._tokens is None:
+            self._tokens = tuple(nltk.word_tokenize(self.lowered))
+        return self._tokens
+
+    @property
+    def token_set(self):
+        if self._token_set is None:
+            self._token_set = frozenset(self.tokens)
+        return self._token_set
+
+    @property
+    def words(self):
+        """
+        Output
+            tuple of the tokens that are words (only letters)
+        """
+        if self._words is None:
+            self._words = tuple(x for x in self.tokens if x.isalpha())
+        return self._words
+
+    @property
+    def language(self):
+        """
+        Output
+            language: tuple of int and str
+        """
+        if self._language is None:
+            self._language = language_detection.detect(self.text)
+        return self._language
+
+    def tagged(self, language):
+        """
+        The POS tags of the tokens that are not stopwords
+
+        Input
+            language: tuple of int and str
+        Output
+            tuple of tuples of the token and its universal tag
+        """
+        return self.analyze(language)[0]
+
+    def keywords(self, language):
+        """
+        Input
+            language: tuple of int and str
+        Output
+            list of the nouns, adjectives and numbers that are not stopwords
+        """
+        return list(self.analyze(language)[1])
+
+    def type(self, types=TYPES):
+        """
+        The type of the message: the first type that has a word of the message
+
+        Input
+            types: dict of the number of a type to its set of words
+        Output
+            type: tuple of the number and the words, or (0, "Unknown")
+        """
+        if types is TYPES:
+            return self.analyze(self.language)[2]
+        return find_type(self.token_set, types)
+
+    def analyze(self, language):
+        """
+        Tag the message in a language, or look it up in the keyword cache.
+        It is tagged again when the stopwords are reloaded.
+
+        Input
+            language: tuple of int and str
+        Output
+            tuple of the POS tags, the keywords and the type (see TYPES)
+        """
+        l = language[1].lower()
+        version = knowledge.version()
+        if (l, version) not in self._analyses:
+            key = (self.normalized, l, version)
+            result = keyword_cache.get(key)
+            if result is None:
+                stopwords = knowledge.get_stopwords(l)
+                tagged = tuple(nltk.pos_tag(
+                    [x for x in self.tokens if x not in stopwords],
+                    tagset='universal', lang=l))
+                keywords = tuple(word for (word, tag) in tagged
+                                 if tag in KEYWORD_TAGS)
+                result = (tagged, keywords, find_type(self.token_set, TYPES))
+                keyword_cache.put(key, result)
+            self._analyses[(l, version)] = result
+        return self._analyses[(l, version)]
+
+    def __str__(self):
+        return self.text
+
+
+def find_type(tokens, types):
+    """
+    Input
+        tokens: set of the tokens of a sentence
+        types: dict of the number of a type to its set of words
+    Output
+        type: tuple of the number and the words of the first type that has a
+            token, or (0, "Unknown")
+    """
+    for key, value in types.items():
+        if len(value.intersection(tokens)) > 0:
+            return (key, value)
+    return (0, "Unknown")
+
+
+@lru_cache(maxsize=256)
+def analyze(text):
+    """
+    Analyze a user message. The analysis of recent messages is kept, so every
+    part of the chatbot that looks at a message shares one analysis.
+
+    Input
+        text: str
+    Output
+        Utterance
+    """
+    return Utterance(text)
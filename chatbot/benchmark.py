@@ -0,0 +1,520 @@
+#!/usr/bin/python3
+#
+# File: benchmark.py
+# Benchmarks of the parts of the chatbot that run on every turn
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# ~ python3 benchmark.py [name ...]
+# Runs the named benchmarks, or all of them.
+
+# Imports
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from threading import Event
+
+from config import *
+
+
+def timed(function, *args, repeat=1):
+    """
+    Time a function
+
+    Input
+        function: the function to call
+        args: the arguments of the function
+        repeat: the number of calls
+
+    Output
+        tuple of the last result and the average time of a call in seconds
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return result, (time.perf_counter() - start)/repeat
+
+
+def faq_engines(files=("extract_site/export_faq_en.txt",
+                       "extract_site/export_faq_nl.txt"), seed=0):
+    """
+    Compare the FAQ ranking engines on the shipped FAQ files. Every FAQ entry
+    with at least three keywords is queried with all but one of its keywords,
+    and should come back as the best match.
+    """
+    import search_faq
+
+    random.seed(seed)
+    for file in files:
+        faq, build = timed(search_faq.FAQIndex.from_file, file)
+        queries = []
+        for i, words in enumerate(faq.documents):
+            if len(set(words)) >= 3 and not faq.excluded[i]:
+                words = list(set(words))
+                words.remove(random.choice(words))
+                queries.append((i, set(words)))
+
+        print(file, "-", len(faq), "entries,", len(queries), "queries,",
+              "index built in %.1f ms" % (build*1000))
+        for name, engine in sorted(search_faq.ENGINES.items()):
+            found, answered, elapsed = 0, 0, 0
+            for i, keywords in queries:
+                best, seconds = timed(faq.top, keywords, (), 1, None, name,
+                                      repeat=10)
+                elapsed += seconds
+                answered += len(best) > 0
+                found += best == [i]
+            print("  %-6s %6.1f us/query  answered %3d  correct %3d (%.0f%%)" %
+                  (name, elapsed/len(queries)*1e6, answered, found,
+                   100*found/len(queries)))
+
+
+def sample_sentences():
+    """
+    Output
+        list of the user sentences in the additional YAML databases
+    """
+    import knowledge
+
+    sentences = []
+    for file in ('additional_en.yml', 'additional_nl.yml'):
+        sentences += [x[0] for x in knowledge.read_yaml(file)['conversations']]
+    return sentences
+
+
+def language_identifiers():
+    """
+    Compare the time per sentence of detecting the language with the English
+    vocabulary rebuilt per call (as it used to be), loaded once, with the
+    trigram model one by one and in a batch, and with the trigram model and
+    the vocabulary for short sentences together.
+    """
+    import nltk
+    import language_detection
+
+    def rebuilt(text):
+        vocabulary = set(w.lower() for w in nltk.corpus.words.words()) | \
+            {NAME.lower()}
+        return language_detection.WordListIdentifier(vocabulary).detect(text)
+
+    sentences = sample_sentences()
+    words = language_detection.WordListIdentifier(
+        w.lower() for w in nltk.corpus.words.words())
+    trigrams = language_detection.TrigramIdentifier.load(LANGUAGE_MODEL)
+    batch = sentences*100
+
+    _, rebuilt_time = timed(lambda: [rebuilt(s) for s in sentences[:10]])
+    _, words_time = timed(lambda: [words.detect(s) for s in batch])
+    _, trigram_time = timed(lambda: [trigrams.detect(s) for s in batch])
+    _, batch_time = timed(trigrams.detect_many, batch)
+    combined = language_detection.LanguageIdentifier(
+        trigrams, language_detection.word_list(
+            language_detection.read_corpora(language_detection.CORPORA)))
+    _, combined_time = timed(combined.detect_many, batch)
+    print("language detection (us/sentence)")
+    print("  vocabulary rebuilt    %8.1f" % (rebuilt_time/10*1e6))
+    print("  vocabulary loaded     %8.1f" % (words_time/len(batch)*1e6))
+    print("  trigrams              %8.1f" % (trigram_time/len(batch)*1e6))
+    print("  trigrams detect_many  %8.1f" % (batch_time/len(batch)*1e6))
+    print("  combined detect_many  %8.1f" % (combined_time/len(batch)*1e6))
+
+
+def level_indexes(seed=0):
+    """
+    Compare matching whole sentences with the study names by an edit distance
+    to every name (as it used to be) and with the level index.
+    """
+    from nltk.metrics import edit_distance
+    import knowledge
+    import level_matching
+
+    def linear(text, names, thresh=NAIVE_THRESH):
+        best_matches = []
+        for name in names:
+            points = edit_distance(text.lower(), name.lower())
+            score = 1-points/max(len(text),len(name))
+            if score > thresh:
+                best_matches.append((name,score))
+        return best_matches
+
+    random.seed(seed)
+    names = list(knowledge.get_studies()['studies'])
+    index = level_matching.get_indexes()['studies']
+    # Half of the sentences are study names with a typo
+    sentences = random.sample(sample_sentences(), 10)
+    for name in random.sample([name for name in names if name], 10):
+        i = random.randrange(len(name))
+        sentences.append(name[:i] + name[i+1:])
+
+    _, before = timed(lambda: [linear(s, names) for s in sentences])
+    _, after = timed(lambda: [index.match_string(s) for s in sentences],
+                     repeat=10)
+    print("level matching of %d names - linear %.2f ms/sentence, "
+          "indexed %.3f ms/sentence" % (len(names),
+                                        before/len(sentences)*1000,
+                                        after/len(sentences)*1000))
+
+
+def bigram_kernel(seed=0):
+    """
+    Compare the double bigram matching of keywords with the clean study names
+    one name at a time (as it used to be) and with the vectorized kernel.
+    """
+    import knowledge
+    import level_matching
+
+    def calc_score(word1, word2):
+        score = 0
+        for i in range(len(word1)):
+            # Max typographical error of 1
+            for k in range(-1,2):
+                if i<len(word2)-k and i+k>=0:
+                    if word1[i] == word2[i+k]:
+                        score += 1
+                        break
+        return score
+
+    def check_sim(checkstring, study, thresh, studyname):
+        studysplit = study.split(" ")
+        best_mscore = 0
+        for h in range(len(studysplit)):
+            word = "".join(studysplit[h:])
+            mscore = calc_score(checkstring,word)
+            if mscore > best_mscore:
+                best_mscore = mscore
+
+        # Test if one of the words of the study is actually in the query
+        best_Tscore = 0
+        best_ratio = 0
+        for studyword in studysplit:
+            Tscore = calc_score(studyword,checkstring)
+            if Tscore > best_Tscore:
+                best_ratio = Tscore/len(studyword)
+                best_Tscore = Tscore
+        if best_ratio>thresh:
+            return best_mscore/(len(studyname.split("(")[0]))
+        return 0
+
+    def linear(keywords, check_list, thresh=BIGRAM_THRESH):
+        best_matches = []
+        for i in range(len(keywords)):
+            checkstring = ""
+            for j in range(i, len(keywords)):
+                checkstring += keywords[j]
+                for study, name in check_list:
+                    if len(checkstring)*thresh < len(study):
+                        score = check_sim(checkstring.lower(),
+                                          study.lower(), thresh, name)
+                        if score > thresh:
+                            best_matches.append((name, score))
+        return best_matches
+
+    random.seed(seed)
+    check_list = knowledge.get_studies()['clean_studies']
+    index = level_matching.get_indexes()['clean_studies']
+    # Keywords of sentences, and words of study names with a typo
+    keywords = [sentence.lower().split()[:4]
+                for sentence in random.sample(sample_sentences(), 10)]
+    # Some names are empty when cleaned, like "Law (Bachelor's)"
+    studies = [study for study, _ in check_list if study.strip()]
+    for study in random.sample(studies, 10):
+        word = random.choice([word for word in study.split(" ") if word])
+        i = random.randrange(len(word))
+        keywords.append(["study", word[:i] + word[i+1:]])
+
+    before, before_time = timed(lambda: [linear(k, check_list)
+                                         for k in keywords])
+    after, after_time = timed(lambda: [index.double_bigram(k)
+                                       for k in keywords], repeat=10)
+    assert before == after
+    print("double bigram of %d names - linear %.2f ms/sentence, "
+          "vectorized %.3f ms/sentence" % (len(check_list),
+                                           before_time/len(keywords)*1000,
+                                           after_time/len(keywords)*1000))
+
+
+class Socket:
+    """
+    A socket (and its server) that sends nothing, for a chatbot without a
+    client
+    """
+
+    def __init__(self):
+        self.server = self
+
+    def enter_room(self, room, sid):
+        pass
+
+    def emit(self, *args, **kwargs):
+        pass
+
+
+def input_latency(turns=5):
+    """
+    Compare the time from a message of the user until the chatbot has it,
+    waiting for it by checking an Event every second (as it used to be) and
+    with the input queue of the chatbot.
+    """
+    from chatbot import Chatbot
+    from sessions import SessionEngine
+
+    class PollingChatbot(Chatbot):
+        def __init__(self, *args, **kwargs):
+            Chatbot.__init__(self, *args, **kwargs)
+            self.Event = Event()
+
+        def get_input(self, original_data):
+            Chatbot.get_input(self, original_data)
+            self.Event.set()
+
+        async def __in__(self):
+            self.Event = Event()
+            while not self.Event.isSet():
+                await asyncio.sleep(1)
+            self.current = await self.inputs.get()
+            return self.current
+
+    async def create(chatbot, sid):
+        return chatbot(Socket(), sid, log=False)
+
+    def latency(engine, bot):
+        received = []
+        async def conversation():
+            for _ in range(turns):
+                await bot.user_input()
+                received.append(time.perf_counter())
+        task = asyncio.run_coroutine_threadsafe(conversation(), engine.loop)
+        latencies = []
+        for turn in range(turns):
+            # Send a message some time after the chatbot started waiting
+            time.sleep(random.random())
+            sent = time.perf_counter()
+            bot.get_input({'message': "message %d" % turn})
+            while len(received) <= turn:
+                time.sleep(0.0001)
+            latencies.append(received[turn] - sent)
+        task.result()
+        return sum(latencies)/turns
+
+    engine = SessionEngine(Socket(), log=False)
+    engine.start()
+    before = latency(engine, engine.call(create(PollingChatbot, "polling")))
+    after = latency(engine, engine.call(create(Chatbot, "queue")))
+    print("input latency - polling %.1f ms/turn, queue %.3f ms/turn" %
+          (before*1000, after*1000))
+
+
+def idle_sessions(n=10000):
+    """
+    Start n conversations that wait for the user, and measure the memory and
+    the threads they use, in memory and after storing them on disk. Ending
+    them should free the memory again.
+    """
+    import shutil
+    import tempfile
+    import threading
+    import tracemalloc
+    from contextlib import redirect_stdout
+    from sessions import SessionEngine
+
+    async def offload():
+        return engine.offload_idle()
+
+    directory = tempfile.mkdtemp()
+    engine = SessionEngine(Socket(), log=False, idle=3600, directory=directory)
+    engine.start()
+    # Load everything that is shared by all sessions first
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        engine.start_session("warm-up")
+        engine.end_session("warm-up")
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for i in range(n):
+            engine.start_session(str(i))
+        # Let every conversation greet and wait for input
+        engine.call(asyncio.sleep(0.1))
+        started = time.perf_counter() - start
+        used = tracemalloc.get_traced_memory()[0] - base
+        threads = threading.active_count()
+        idle = len(engine)
+
+        # Store them all
+        engine.idle = 0
+        start = time.perf_counter()
+        stored = len(engine.call(offload()))
+        engine.call(asyncio.sleep(0.1))
+        stored_time = time.perf_counter() - start
+        stored_used = tracemalloc.get_traced_memory()[0] - base
+        disk = sum(os.path.getsize(os.path.join(directory, file))
+                   for file in os.listdir(directory))
+
+        # Answer one, which loads it again
+        start = time.perf_counter()
+        engine.query("0", {'message': "Hi"})
+        loaded_time = time.perf_counter() - start
+
+        for i in range(n):
+            if str(i) in engine:
+                engine.end_session(str(i))
+        engine.call(asyncio.sleep(0.1))
+    freed = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    shutil.rmtree(directory)
+    print("%d idle sessions - %d threads, started in %.1f s, %.1f MB "
+          "(%.1f KB/session)" % (idle, threads, started, used/2**20,
+                                 used/n/1024))
+    print("%d stored sessions - stored in %.1f s, %.1f MB in memory, %.1f MB "
+          "on disk (%.1f KB/session), loaded again in %.1f ms" %
+          (stored, stored_time, stored_used/2**20, disk/2**20, disk/n/1024,
+           loaded_time*1000))
+    print("%.1f MB after ending them" % (freed/2**20))
+
+
+def analysis_pool(n=500):
+    """
+    Analyze sentences of many sessions at the same time, in the event loop
+    and in a pool of ANALYSIS_WORKERS workers. While a sentence is analyzed
+    in the event loop, the other sessions wait: the longest wait is measured
+    with a task that wakes up every millisecond.
+    """
+    from contextlib import redirect_stdout
+    from executor import AnalysisPool
+
+    async def analyze(pool, sentences):
+        waits = [0.0]
+        done = False
+
+        async def ticker():
+            last = time.perf_counter()
+            while not done:
+                await asyncio.sleep(0.001)
+                now = time.perf_counter()
+                waits.append(now - last)
+                last = now
+
+        tick = asyncio.ensure_future(ticker())
+        start = time.perf_counter()
+        await asyncio.gather(*[pool.analyze(x) for x in sentences])
+        elapsed = time.perf_counter() - start
+        done = True
+        await tick
+        return elapsed/len(sentences), max(waits)
+
+    sentences = sample_sentences()[:n]
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        # Start the workers first, so they do not get the sentences this
+        # process analyzes in their caches
+        workers = AnalysisPool(ANALYSIS_WORKERS)
+        workers.start()
+        pooled, pooled_wait = asyncio.run(analyze(workers, sentences))
+        info = workers.info()
+        workers.stop()
+        inline, inline_wait = asyncio.run(analyze(AnalysisPool(0), sentences))
+    print("analysis - in the event loop: %.2f ms/sentence, sessions wait up "
+          "to %.0f ms" % (inline*1000, inline_wait*1000))
+    print("analysis - %d workers: %.2f ms/sentence, sessions wait up to "
+          "%.1f ms, at most %d sentences waiting for a worker" %
+          (info['workers'], pooled*1000, pooled_wait*1000,
+           info['max_waiting']))
+
+
+def start_server(workers, port):
+    """
+    Start run.py with a number of workers, and wait until they accept clients
+
+    Input
+        workers: int
+        port: the port of the front process
+    Output
+        subprocess.Popen of the server
+    """
+    import socket
+    import subprocess
+
+    server = subprocess.Popen([sys.executable, "run.py", "--workers",
+                               str(workers), "--port", str(port)],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    for p in range(port, port + 1 + workers):
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("run.py stopped with code %d" %
+                                   server.returncode)
+            try:
+                socket.create_connection(("127.0.0.1", p), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.5)
+    return server
+
+
+def swarm(clients=50, turns=5, timeout=30):
+    """
+    Start the server with one worker and with a worker per core, and let a
+    swarm of Socket.IO clients talk to it at the same time. A turn takes from
+    the message of a client until the first answer of the chatbot.
+    """
+    import socketio
+    from threading import Thread
+
+    def client(url, sentences, latencies):
+        answered = Event()
+        sio = socketio.Client()
+        sio.on('response_gerrit', lambda message: answered.set())
+        sio.connect(url)
+        sio.emit('start')
+        answered.wait(timeout)
+        for sentence in random.sample(sentences, turns):
+            answered.clear()
+            sent = time.perf_counter()
+            sio.emit('query', {'message': sentence})
+            if answered.wait(timeout):
+                latencies.append(time.perf_counter() - sent)
+        sio.emit('disconnected')
+        sio.disconnect()
+
+    sentences = sample_sentences()
+    port = PORT + 100
+    for workers in sorted({1, os.cpu_count() or 1}):
+        server = start_server(workers, port)
+        try:
+            latencies = []
+            threads = [Thread(target=client, args=("http://127.0.0.1:%d" %
+                                                   port, sentences, latencies))
+                       for _ in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+        latencies.sort()
+        median = latencies[len(latencies)//2] if latencies else 0
+        slow = latencies[int(len(latencies)*0.95)] if latencies else 0
+        print("swarm - %d workers, %d clients: %.1f turns/s, median %.0f ms, "
+              "95th percentile %.0f ms, %d turns unanswered" %
+              (workers, clients, len(latencies)/elapsed, median*1000,
+               slow*1000, clients*turns - len(latencies)))
+
+
+# The available benchmarks by name
+BENCHMARKS = {'faq': faq_engines, 'language': language_identifiers,
+              'levels': level_indexes, 'bigram': bigram_kernel,
+              'input': input_latency, 'sessions': idle_sessions,
+              'analysis': analysis_pool, 'swarm': swarm}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -12,9 +12,10 @@
 # Imports
 import random
 import nltk
-from ruamel.yaml import YAML
 from flask_socketio import SocketIO
-from threading import Thread, Event
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 from flask import escape, request
 import time
 import pwd
@@ -24,8 +25,104 @@ from config import *
 
 # FAQ
 import search_faq
+import search_additional
+import confirmation
 import search_extract
 import chatbot_interface
+import executor
+import knowledge
+import resources
+
+
+# Writes the log files of all chatbots in one thread, in order, so the event
+# loop of the sessions never waits for the disk
+log_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log")
+
+
+def append_log(file, line):
+    """
+    Input
+        file: path of the log file
+        line: str
+    """
+    with open(file, 'a') as f:
+        f.write(line)
+
+
+def remove_short_log(file, minlines):
+    """
+    Remove a log file of at most minlines lines
+
+    Input
+        file: path of the log file
+        minlines: int
+    """
+    remove = True
+    count = 0
+    for line in open(file, 'r'):
+        count += 1
+        if count > minlines:
+            remove = False
+            break
+
+    print("count", count, "remove:", remove)
+    if remove:
+        os.remove(file)
+
+
+def check_log_file(file, minlines=5):
+    """
+    Remove a log file if the conversation was too short, after the lines that
+    are not written yet
+
+    Input
+        file: path of the log file
+        minlines: int
+    """
+    log_writer.submit(remove_short_log, file, minlines)
+
+
+class LanguageResources:
+    """
+        Everything a chatbot needs for one language, shared by all chatbots
+        that speak it
+    """
+
+    def __init__(self, core_file, add_file, faq):
+        """
+            Input:
+                core_file: YAML core of the language
+                add_file: additional YAML database of the language
+                faq: FAQ file of the language
+        """
+        self.core_file = core_file
+        self.add_file = add_file
+        self.faq = faq
+        self.core = knowledge.get_yaml(core_file)
+        self.additional = knowledge.get_yaml(add_file)
+        self.confirmation = confirmation.load_matcher(core_file)
+        self.additional_matcher = search_additional.load_matcher(add_file)
+
+
+def load_language(core_file, add_file, faq):
+    """
+        Get the resources of a language, loading them only the first time (and
+        again when one of the files changes)
+        Input:
+            core_file: YAML core of the language
+            add_file: additional YAML database of the language
+            faq: FAQ file of the language
+        Output:
+            LanguageResources
+    """
+    name = 'language:' + core_file + ':' + add_file + ':' + faq
+    # The matchers are registered first, so they are reloaded first
+    confirmation.load_matcher(core_file)
+    search_additional.load_matcher(add_file)
+    resources.register(name, lambda: LanguageResources(core_file, add_file, faq),
+                       depends=['knowledge', 'confirmation:' + core_file,
+                                'additional:' + add_file])
+    return resources.get(name)
 
 
 class Chatbot:
@@ -46,10 +143,9 @@ class Chatbot:
         self.add_nl = add_nl
         self.core = None
         self.additional = None
-        self.socket = socket
+        self.attach(socket)
         self.session_id = session
         self.current = None
-        self.Event = None
         self.log = log
         self.fooled = False
         self.extract = self_extract
@@ -88,22 +184,65 @@ class Chatbot:
                 f.write('\n')
         # self.socket.emit('response_gerrit
 
+    def attach(self, socket):
+        """
+            Connect the chatbot to the socket, and to the event loop the
+            conversation runs in
+            Input:
+                socket: Flask SocketIO object
+        """
+        self.socket = socket
+        self.loop = asyncio.get_event_loop()
+        # The inputs of the user that are not handled yet
+        self.inputs = asyncio.Queue()
+
+    def __getstate__(self):
+        """
+            The chatbot without its socket, its event loop and the resources
+            shared by all chatbots, to store it (see sessions.py)
+        """
+        state = self.__dict__.copy()
+        for name in ['socket', 'loop', 'inputs', 'core', 'additional']:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        """
+            Restore a stored chatbot, which still needs to be attached
+        """
+        self.__dict__.update(state)
+        self.socket, self.loop, self.inputs = None, None, None
+        language = self.get_language_resources()
+        self.core = language.core
+        self.additional = language.additional
+
     def fool(self):
         self.fooled = True
 
+    def write_log(self, line):
+        """
+            Add a line to the log file, after the lines before it
+            Input:
+                line: str
+        """
+        if self.log:
+            log_writer.submit(append_log, self.file, line)
+
     def check_log(self, minlines=5):
+        """
+            Remove the log file if the conversation was too short, after
+            the lines that are not written yet
+        """
         if self.log:
-            remove = True
-            count = 0
-            for line in open(self.file, 'r'):
-                count += 1
-                if count > minlines:
-                    remove = False
-                    break
-
-            print("count", count, "remove:", remove)
-            if remove:
-                os.remove(self.file)
+            check_log_file(self.file, minlines)
+
+    def get_log_file(self):
+        """
+            Output:
+                the path of the log file, or None if the conversation is not
+                logged
+        """
+        return self.file if self.log else None
 
     def user_set_language(self, num):
         """
@@ -122,21 +261,27 @@ class Chatbot:
             Sets the language and the corresponding core
         """
         self.language = l
-        yaml = YAML()
         if l[0] == 0:
-            with open(self.core_nl) as y:
-                self.core = yaml.load(y)
-            with open(self.add_nl) as y:
-                self.additional = yaml.load(y)
-            self.faq = self.extract + "export_faq_nl.txt"
+            self.language_files = (self.core_nl, self.add_nl,
+                                   self.extract + "export_faq_nl.txt")
         else:
-            with open(self.core_en) as y:
-                self.core = yaml.load(y)
-            with open(self.add_en) as y:
-                self.additional = yaml.load(y)
-            self.faq = self.extract + "export_faq_en.txt"
+            self.language_files = (self.core_en, self.add_en,
+                                   self.extract + "export_faq_en.txt")
+        language = self.get_language_resources()
+        self.core = language.core
+        self.additional = language.additional
+        self.faq = language.faq
         self.socket.emit('change_language_self', l[0])
 
+    def get_language_resources(self):
+        """
+            Returns the shared resources of the current language, reloaded
+            if a file changed
+            output:
+                LanguageResources
+        """
+        return load_language(*self.language_files)
+
     def get_language(self):
         """
             Returns the current chatbot language
@@ -278,13 +423,13 @@ class Chatbot:
         self.__out__(self.__call_core__('g_closing'))
 
     # Input types
-    def user_input(self):
+    async def user_input(self):
         """
             Returns input from the user
             Output:
                 user_input: str
         """
-        return self.__in__()
+        return await self.__in__()
 
     def is_confirmation(self, str: str):
         """
@@ -294,15 +439,7 @@ class Chatbot:
             Returns:
                 bool: True: conf, False: neg, else None
         """
-        conf, neg = False, False
-
-        for x in self.core['u_confirmation']:
-            if x.lower() in str.lower():
-                conf =  True
-
-        for x in self.core['u_negation']:
-            if x.lower() in str.lower():
-                neg = True
+        conf, neg = self.get_language_resources().confirmation.match(str)
 
         if conf and neg:
             self.__out__(self.__call_core__('g_fool'))
@@ -312,38 +449,46 @@ class Chatbot:
             return not neg
         return None
 
-    def match_faq(self, keywords: set):
+    async def match_faq(self, keywords: set):
         """
-            Match set of keywords with FAQ
+            Match set of keywords with FAQ, ranked by a worker (see
+            executor.py)
             Input:
                 keywords: set
             Output:
-                faq answer: tuple or None
+                faq answers: list of tuples, best first
         """
         if len(keywords) >= 2:
-            faq = search_faq.get_faq(
+            return await executor.pool.faqs(
                 keywords, self.faq, self.language[1], self.faqs)
-            if faq != None:
-                self.faqs += [faq[0]]
-            return faq
-        return None
+        return []
 
-    def match_additional(self, keywords: set, sentence: str):
+    def ask_faq(self, faq: tuple):
+        """
+            Ask the user whether an FAQ is their question, and remember it
+            so it is not asked again
+            Input:
+                faq: tuple
+        """
+        self.faqs += [faq[0]]
+        self.confirm(faq[0])
+
+    def match_additional(self, keywords: set, sentence):
         """
             Match set of keywords with additional questions
             Input:
                 keywords: set
+                sentence: Sentence, its words are matched first
             Output:
                 faq answer: tuple or None
         """
 
-        sent = [x for x in nltk.word_tokenize(sentence.lower()) if x.isalpha()]
+        matcher = self.get_language_resources().additional_matcher
 
         # Baseline using str
-        for x in self.additional['conversations']:
-            s = [x.lower() for x in nltk.word_tokenize(x[0]) if x.isalpha()]
-            if s == sent:
-                return x[1]
+        answer = matcher.match_sentence(sentence.utterance.words)
+        if answer is not None:
+            return answer
 
         l = len(keywords)
         if l:
@@ -353,15 +498,7 @@ class Chatbot:
             if (keywords - {NAME.lower()}) <= {'date', 'datum', 'day', 'dag', 'vandaag', 'today', 'what', 'welke'}:
                 return time.strftime("%A %d-%m-%Y")
 
-            for x in self.additional['conversations']:
-                s = [x.lower() for x in nltk.word_tokenize(x[0]) if x.isalpha()]
-                # Harder to match small sentences
-                if l == 1 and len(s) > 5:
-                    if keywords == set(s) or keywords == set(s + EXTRA_ADDITIONAL):
-                        return x[1]
-                else:
-                    if keywords <= set(s + EXTRA_ADDITIONAL):
-                        return x[1]
+            return matcher.match_keywords(keywords)
         return None
 
     # Private class functions
@@ -381,9 +518,7 @@ class Chatbot:
                 output: str
         """
         print("Gerrit: "+output)
-        if self.log:
-            with open(self.file, 'a') as f:
-                f.write('C: '+output+'\n')
+        self.write_log('C: '+output+'\n')
 
         print("emit at", self.session_id)
         self.socket.emit('response_gerrit', output, room=self.session_id)
@@ -408,9 +543,7 @@ class Chatbot:
         self.current = str(data)
 
         # Log
-        if self.log:
-            with open(self.file, 'a') as f:
-                f.write('U: '+self.current+'\n')
+        self.write_log('U: '+self.current+'\n')
 
         # Respond
         print("emit at", self.session_id)
@@ -420,18 +553,15 @@ class Chatbot:
         if len(data) != len(original_data) or self.fooled:
             self.__out__(self.__call_core__('g_fool'))
             self.fooled = False
-        self.Event.set()
+        self.loop.call_soon_threadsafe(self.inputs.put_nowait, self.current)
 
-    def __in__(self):
+    async def __in__(self):
         """
-            Ask input from the user
+            Ask input from the user, waiting until it arrives
             Output:
                 response: str
         """
-        self.Event = Event()
-        while not self.Event.isSet():
-            time.sleep(1)
-
+        self.current = await self.inputs.get()
         return self.current
 
 
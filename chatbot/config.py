@@ -24,8 +24,19 @@ REP_EXTEND = 1
 # Threshold before accepting an FAQ
 FAQ_THRES = 0.6
 
-# # TODO:
-# Amount of max faq matches
+# The way FAQ entries are ranked
+# Options: "tfidf" (cosine similarity) / "bm25"
+FAQ_ENGINE = "tfidf"
+
+# Threshold before accepting an FAQ with the "bm25" engine. An entry of average
+# length with all keywords scores 1.
+BM25_THRES = 0.6
+# Term frequency saturation and length normalisation of the "bm25" engine
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Amount of max faq matches that are proposed to the user for one question
+# [int greater than 0]
 FAQ_MATCHES = 1
 
 
@@ -38,6 +49,55 @@ NAME = "Gerrit"
 # Options: "English" / "Dutch"
 LANGUAGE = "English"
 
+# Every this many seconds the FAQ files, the study and faculty files and the
+# YAML cores are checked for changes, and reloaded if they changed.
+# [float greater than 0]
+RELOAD_INTERVAL = 10
+
+# The compiled knowledge base (stopwords, studies, faculties and YAML cores)
+# Compile it with ~ python3 knowledge.py
+SNAPSHOT = "knowledge.pickle"
+
+# The character trigram model used to detect the language of a sentence
+# Train it with ~ python3 language_detection.py --train
+LANGUAGE_MODEL = "language_model.npz"
+# Texts of at most this many words have too few trigrams for the model, their
+# language is detected with the English word list
+# [int, 0 or greater]
+SHORT_TEXT = 2
+
+# Number of sentences of which the POS tags, keywords and type are kept, for
+# all sessions together. Check analysis.keyword_cache.info() to size it.
+# [int greater than 0]
+KEYWORD_CACHE_SIZE = 10000
+
+# Conversations that wait for the user longer than this many seconds are
+# stored in SESSION_DIR, and loaded again when the user answers.
+# [float greater than 0]
+SESSION_IDLE = 300
+SESSION_DIR = "sessions/"
+
+# Number of worker processes that run the conversations, forked after warming
+# up. A front process on PORT routes every client to its worker, and worker i
+# listens on PORT + 1 + i. With 0 everything runs in one process.
+# Can be set with ~ python3 run.py --workers 4
+# [int, 0 or greater]
+WORKERS = 0
+PORT = 5000
+
+# Number of worker processes that analyze the messages of the users (POS tags,
+# keywords, type, language, level and FAQ matches), so the sessions do not wait
+# for each other. They are started after warming up. With 0 the messages are
+# analyzed in the process of the sessions. This is the number per process that
+# runs conversations: with WORKERS > 0 every worker has its own pool, so there
+# are WORKERS * ANALYSIS_WORKERS analysis processes.
+# [int, 0 or greater]
+ANALYSIS_WORKERS = 2
+# A warning is printed when more messages than this wait for a worker. Check
+# executor.pool.info() for the queue depth.
+# [int greater than 0]
+ANALYSIS_QUEUE_WARN = 16
+
 # Addtional matching words to ignore in input as keywords
 # Used in chatbot -> match_additional
 EXTRA_ADDITIONAL = ['gerrit', 'i', 'ik', 'you', 'jij', 'mijn', 'my', 'want']
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+#
+# File: confirmation.py
+# Recognises confirmations and negations (like "yes" and "no") in user input
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# >>> matcher = confirmation.load_matcher("core_en.yml")
+# >>> matcher.match("Yes, that is correct")
+# (True, False)
+
+# Imports
+import regex as re
+
+import knowledge
+import resources
+from config import *
+
+
+def normalize(phrase):
+    """
+    Input
+        phrase: str
+    Output
+        the phrase in lowercase with single spaces: str
+    """
+    return " ".join(phrase.lower().split())
+
+
+class ConfirmationMatcher:
+    def __init__(self, confirmations, negations):
+        """
+        Compile the confirmation and negation phrases of a language into one
+        regular expression. Phrases only match whole words, so "no" is not
+        found in "know".
+
+        Input
+            confirmations: list of str
+            negations: list of str
+        """
+        # Every phrase to whether it is a confirmation and a negation
+        self.phrases = {}
+        for phrase in confirmations:
+            self.phrases.setdefault(normalize(phrase), [False, False])[0] = True
+        for phrase in negations:
+            self.phrases.setdefault(normalize(phrase), [False, False])[1] = True
+
+        # Longest phrases first, so "not what i meant" wins from "not"
+        alternatives = [r"\s+".join(re.escape(word) for word in phrase.split())
+                        for phrase in sorted(self.phrases, key=len,
+                                             reverse=True) if phrase]
+        if alternatives:
+            self.pattern = re.compile(r"(?<!\w)(?:" + "|".join(alternatives) +
+                                      r")(?!\w)", re.IGNORECASE)
+        else:
+            self.pattern = None
+
+    @classmethod
+    def from_file(cls, file):
+        core = knowledge.get_yaml(file)
+        return cls(core['u_confirmation'], core['u_negation'])
+
+    def match(self, text):
+        """
+        Find the confirmations and negations in a text in one pass
+
+        Input
+            text: str
+        Output
+            tuple of bools: whether the text has a confirmation and whether
+            it has a negation
+        """
+        conf, neg = False, False
+        if self.pattern is not None:
+            for found in self.pattern.finditer(text):
+                is_conf, is_neg = self.phrases[normalize(found.group())]
+                conf, neg = conf or is_conf, neg or is_neg
+        return conf, neg
+
+
+def load_matcher(file):
+    """
+    Get the matcher of the confirmations and negations of a YAML core,
+    compiling it only the first time (and again when the core changes)
+
+    Input
+        file: YAML file with 'u_confirmation' and 'u_negation'
+
+    Output
+        ConfirmationMatcher
+    """
+    name = 'confirmation:' + file
+    # The YAML file is registered first, so it is reloaded first
+    knowledge.get_yaml(file)
+    resources.register(name, lambda: ConfirmationMatcher.from_file(file),
+                       [file], depends=['knowledge'])
+    return resources.get(name)
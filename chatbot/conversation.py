@@ -13,26 +13,32 @@
 import nltk
 import sys
 from nltk.metrics import *
-import ast
 
+import analysis
+import knowledge
+import level_matching
 from config import *
 
 
 class Conversation:
-    def __init__(self, sentence):
+    def __init__(self, sentence, first=None):
         """
             Initialise a conversation with a sentence
 
             Input
                 sentence (str)
+                first: the Sentence of sentence if it is already analyzed
+                    (see executor.py)
         """
         self.set_types()
         self.main_string   = sentence
-        self.main_language = Conversation.language(sentence)
-        self.stopwords     = self.set_all_stopwords()
-        self.extract       = "extract_site/"
-        self.studies       = self.set_all_studies()
-        self.sentences     = [Sentence(sentence, self, self.main_language)]
+        if first is None:
+            self.main_language = Conversation.language(sentence)
+            first = Sentence(sentence, self, self.main_language)
+        else:
+            self.main_language = first.get_language()
+            first.set_conversation(self)
+        self.sentences     = [first]
         self.keywords      = set()
         self.set_conversation_keywords(self.sentences[0])
         self.set_level(self.sentences[0].get_level())
@@ -50,8 +56,17 @@ class Conversation:
         """
         self.sentences += [Sentence(sentence, self)]
 
-    def add_rephrase(self, sentence):
-        rephrase = Sentence(sentence, self)
+    def add_rephrase(self, sentence, rephrase=None):
+        """
+            Add a rephrase of the question to the conversation
+            Input
+                sentence (str)
+                rephrase: the Sentence of sentence if it is already analyzed
+        """
+        if rephrase is None:
+            rephrase = Sentence(sentence, self)
+        else:
+            rephrase.set_conversation(self)
         self.sentences += [rephrase]
         self.main_string = sentence
         self.set_conversation_keywords(rephrase)
@@ -73,20 +88,21 @@ class Conversation:
                 bool
         """
         # Nog geen check op type van D
-
-        # Hardcoded, language detection not needed
         if D == None:
-            D = {1: {'wie', 'who'},
-                 2: {'what', 'wat', 'whut'},
-                 3: {'where', 'waar', 'war'},
-                 4: {'why', 'wy', 'waarom', 'wrm', 'warom', 'waarrom'},
-                 5: {'when', 'wen', 'wanneer', 'waneer', 'wanner'},
-                 6: {'how', 'hoe'},
-                 7: {'which', 'welke'}
-                 }
+            D = analysis.TYPES
         self.types = D
         return True
 
+    def __setstate__(self, state):
+        """
+            Restore a stored conversation (see sessions.py). Pickling copies
+            the types, so the shared table is used again if they are the
+            same, and the analysis keeps its cached type.
+        """
+        self.__dict__.update(state)
+        if self.types == analysis.TYPES:
+            self.types = analysis.TYPES
+
     def get_types(self):
         """
             Returns the types
@@ -236,89 +252,30 @@ class Conversation:
         """
         return self.confirmed_reformed
 
-    def set_all_stopwords(self):
-        """
-            Creates a dictionary with language as key and a set of all stopwords
-            for that given language.
-            For the Dutch nltk we add additional stopwords from a file
-        """
-        stopwords = {}
-        dutch_stopwords = set()
-        with open('stopwoorden.txt') as f:
-            for line in f:
-                dutch_stopwords.add(line)
-        nltk_dutch = set(nltk.corpus.stopwords.words('dutch'))
-        stopwords['dutch'] = dutch_stopwords.union(nltk_dutch)
-        stopwords['english'] = set(nltk.corpus.stopwords.words('english'))
-        return stopwords
-
     def get_stopwords(self, language):
         """
             Input: either 'dutch' or 'english'
             Output: only the stopwords for the desired language
         """
-        return self.stopwords[language]
-
-    def extract_from_file(self, filename):
-        with open(self.extract+filename, 'r') as file:
-            reader = file.readlines()
-            all_lines = set([line for line in reader])
-        return all_lines
-
-    def read_dict(self, filename):
-        abbr_dict = {}
-        with open(self.extract+filename, 'r') as file:
-            reader = file.readlines()
-            dictstring = reader[0]
-            abbr_dict = ast.literal_eval(dictstring)
-        return abbr_dict
-
-    def set_all_studies(self):
-        studict = self.read_dict('faculty_studies.txt')
-
-        all_studies = set()
-        for value in studict.values():
-            for item in value:
-                all_studies.add(item)
-
-        faculty_studies = {}
-        faculty_studies['studies'] = all_studies
+        return knowledge.get_stopwords(language)
 
-        abbr_studies = self.read_dict('afk_en.txt')
-        abbr_studies = dict(abbr_studies,**(self.read_dict('afk_nl.txt')))
-
-        faculty_studies['abbr_stu'] = abbr_studies
-
-        faculties = self.extract_from_file('faculties_eng.txt')
-        faculties = faculties.union(self.extract_from_file('faculties_dut.txt'))
-
-        faculty_studies['faculties'] = faculties
-
-        return faculty_studies
-
-    def get_studies(self, language):
+    def get_studies(self, name):
         """
-            Input: either 'dutch' or 'english'
-            Output: only the studies/faculties for the desired language
+            Input: either 'studies', 'faculties' or 'abbr_stu'
+            Output: only the studies/faculties/abbreviations
         """
-        return self.studies[language]
+        return knowledge.get_studies()[name]
 
     def language(text):
         # @staticmethod
         """
             Define the language of a text (Dutch/English)
-            Source: https://stackoverflow.com/questions/3182268/nltk-and-language-detection
             Input:
                 text: str
             Output:
                 language: tuple of int and str
         """
-        english_vocab = set(w.lower() for w in nltk.corpus.words.words()) | {NAME.lower()}
-        text_vocab = set(w.lower() for w in text.split(' ') if w.lower().isalpha())
-        diff = text_vocab.difference(english_vocab)
-        if (len(diff) / len(text.split(' '))) < 0.2:
-            return (1, "English")
-        return (0, "Dutch")
+        return analysis.analyze(text).language
 
 
 class Sentence:
@@ -327,8 +284,11 @@ class Sentence:
             Initialise a Sentence with a sentence
             Input:
                 sentence: str
+                conv: Conversation, or None to analyze the sentence on its
+                    own (see set_conversation)
         """
         self.set_string(sentence)
+        self.utterance = analysis.analyze(sentence)
         self.conversation = conv
         if language == None:
             self.set_language()
@@ -338,6 +298,16 @@ class Sentence:
         self.set_keywords(conv)
         self.set_level()
 
+    def set_conversation(self, conv):
+        """
+            Add the sentence to a conversation, if it was analyzed without one
+            Input:
+                conv: Conversation
+        """
+        self.conversation = conv
+        if conv.get_types() is not analysis.TYPES:
+            self.set_type()
+
     # STRING
     def set_string(self, text):
         """
@@ -360,7 +330,7 @@ class Sentence:
         """
             Set the language of the sentence
         """
-        self.language = Conversation.language(self.string)
+        self.language = self.utterance.language
 
     def get_language(self):
         return self.language
@@ -372,12 +342,11 @@ class Sentence:
             Output:
                 bool
         """
-        text = set(nltk.word_tokenize(self.string.lower()))
-        for key, value in Conversation.get_types(self.conversation).items():
-            if len(value.intersection(text)) > 0:
-                self.type = (key, value)
-                return True
-        self.type = (0, "Unknown")
+        if self.conversation is None:
+            types = analysis.TYPES
+        else:
+            types = Conversation.get_types(self.conversation)
+        self.type = self.utterance.type(types)
         return True
 
     def get_type(self):
@@ -388,116 +357,29 @@ class Sentence:
         """
         return self.type
 
-    def calc_score(self, word1, word2):
-        """
-            Calculate the score of matching two words with double bigram
-            approach.
-            Input:
-                word1: string
-                word2: string
-            Output:
-                score: the similarity score of the words
-        """
-        score = 0
-        for i in range(len(word1)):
-            # Max typographical error of 1
-            for k in range(-1,2):
-                if i<len(word2)-k and i+k>=0:
-                    if word1[i] == word2[i+k]:
-                        score += 1
-                        break
-        return score
-
-    def check_sim(self, checkstring, study, thresh, studyname):
-        """
-            Checks the similarity of combinations of the study with the input
-            Input:
-                checkstring: string of a given combination of input
-                study: string with the stripped studyname
-                thresh: int of the threshold
-                studyname: string of the full name of the given study
-        """
-        studysplit = study.split(" ")
-        best_mscore = 0
-        for h in range(len(studysplit)):
-            word = "".join(studysplit[h:])
-            mscore = self.calc_score(checkstring,word)
-            if mscore > best_mscore:
-                best_mscore = mscore
-
-        # Test if one of the words of the study is actually in the query
-        best_Tscore = 0
-        best_ratio = 0
-        for studyword in studysplit:
-            Tscore = 0
-            Tscore = self.calc_score(studyword,checkstring)
-            if Tscore > best_Tscore:
-                best_ratio = Tscore/len(studyword)
-                best_Tscore = Tscore
-        if best_ratio>thresh:
-            return best_mscore/(len(studyname.split("(")[0]))
-        return 0
-
-    def double_bigram(self, check_list, thresh=BIGRAM_THRESH):
+    def double_bigram(self, index, thresh=BIGRAM_THRESH):
         """
             Extract the level of the sentence using a max typographical error
-            distance of 1.
+            distance of 1. All items are compared at once.
             Input:
-                check_list: list of items to be compared
+                index: BigramIndex of the items to be compared
                 thresh: threshold whether a match is good enough
+            Output:
+                best_matches: list of tuples of matched studies and score
         """
-        best_matches = []
-        for i in range(len(self.keywords)):
-            checkstring = ""
-            for j in range(i,len(self.keywords)):
-                checkstring += self.keywords[j]
-                for study_tup in check_list:
-                    study = study_tup[0]
-                    if len(checkstring)*thresh < len(study):
-                        check_study = study.lower()
-                        checkstring = checkstring.lower()
-                        score = self.check_sim(checkstring,check_study,thresh,study_tup[1])
-                        if score > thresh:
-                            best_matches.append((study_tup[1],score))
-        return best_matches
+        return index.double_bigram(self.keywords, thresh)
 
-    def extract_level(self, check_list, thresh=STUDY_THRESH):
+    def extract_level(self, index, thresh=STUDY_THRESH):
         """
             Extract the level of the sentence by comparing the keywords
-            of the sentence with all items of a given list
+            of the sentence with the items of a level index
             Input:
-                kw: list of keywords of the sentence
+                index: LevelIndex of the items to be compared
                 thresh: threshold whether a match is good enough
-                check_list: list of items to be compared
             Output:
                 best_matches: list of tuples of matched studies and score
         """
-        best_matches = []
-        # Check everything to be checked
-        for check in check_list:
-            score = 0
-            # Clean every instance of the checklist
-            checklist = check.split("(")
-            s = len(checklist)
-            if len(checklist) > 1:
-                s = -1
-            checkclean = [x for x in
-                            nltk.word_tokenize("".join(checklist[:s]).lower())
-                            if len(x) != 1 and "'" not in x and x != 'der']
-            # If a keyword of the sentence is found in the
-            # instance, increment score
-            for word in self.keywords:
-                if word in checkclean:
-                    score += 1
-            # Calculate the score of this instance
-            if len(checkclean) == 0:
-                word_score = 0
-            else:
-                word_score = score/len(checkclean)
-            # Add the instance and score to good matches if it exceeds threshold
-            if word_score > thresh:
-                best_matches.append((check,word_score))
-        return best_matches
+        return index.match_keywords(self.keywords, thresh)
 
     def lookup_abbr(self, all_abbr):
         """
@@ -515,22 +397,16 @@ class Sentence:
                     best_matches.append((all_abbr[word],1))
         return best_matches
 
-    def match_input_string(self, check_list, thresh=NAIVE_THRESH):
+    def match_input_string(self, index, thresh=NAIVE_THRESH):
         """
             Match the whole user input with the study
             Input:
-                check_list: list of items to be compared
+                index: LevelIndex of the items to be compared
                 thresh: threshold whether a match is good enough
             Output:
                 best_matches: list of tuples of matched studies and score
         """
-        best_matches = []
-        for check in check_list:
-            points = edit_distance(self.get_string().lower(), check.lower())
-            score = 1-points/max(len(self.get_string()),len(check))
-            if score > thresh:
-                best_matches.append((check,score))
-        return best_matches
+        return index.match_string(self.get_string(), thresh)
 
     # LEVEL
     def set_level(self):
@@ -541,35 +417,27 @@ class Sentence:
         """
         level = None
 
-        # Use the list of the given language
-        all_studies = self.conversation.studies['studies']
-        all_faculties = self.conversation.studies['faculties']
-        all_stu_abbr = self.conversation.studies['abbr_stu']
+        # Use the lists shared by all conversations
+        studies = knowledge.get_studies()
+        all_stu_abbr = studies['abbr_stu']
+        indexes = level_matching.get_indexes()
 
         # Check the input with those lists
-        best_matches = self.match_input_string(all_faculties)
+        best_matches = self.match_input_string(indexes['faculties'])
         if not best_matches:
-            best_matches = self.match_input_string(all_studies)
+            best_matches = self.match_input_string(indexes['studies'])
         if not best_matches:
             best_matches = self.lookup_abbr(all_stu_abbr)
         if not best_matches:
-            best_matches = self.extract_level(all_faculties)
+            best_matches = self.extract_level(indexes['faculties'])
         if not best_matches:
-            best_matches = self.extract_level(all_studies)
+            best_matches = self.extract_level(indexes['studies'])
 
         # If no level could be extracted using the naive functions
         if not best_matches:
-            all_clean_studies = [(" ".join([x for x in
-                nltk.word_tokenize(" ".join(item.lower().split("(")[:-1])) if
-                len(x) > 3 and "'" not in x]),item) for item in all_studies]
-
-            all_clean_faculties = [(" ".join([x for x in
-                nltk.word_tokenize(item.lower()) if len(x) > 3 and "'" not in
-                x]),item) for item in all_faculties]
-
-            best_matches = self.double_bigram(all_clean_faculties)
+            best_matches = self.double_bigram(indexes['clean_faculties'])
             if not best_matches:
-                best_matches = self.double_bigram(all_clean_studies)
+                best_matches = self.double_bigram(indexes['clean_studies'])
 
         # Save the level with the highest score
         if best_matches:
@@ -592,17 +460,11 @@ class Sentence:
         """
             Get the keywords of the sentence
         """
-        tokens = {'NOUN', 'ADJ', 'NUM'}
-        l = self.language[1].lower()
-        sentence = self.string.lower()
-        tokenized = nltk.word_tokenize(sentence)
-        stopwords = conv.get_stopwords(l)
-        tagged = nltk.pos_tag([x for x in tokenized if x not in stopwords],
-                              tagset='universal', lang=l)
+        tagged = self.utterance.tagged(self.language)
         print("####")
-        print(tagged)
+        print(list(tagged))
         print("####")
-        self.keywords = [word for (word, token) in tagged if token in tokens]
+        self.keywords = self.utterance.keywords(self.language)
 
     def get_keywords(self):
         """
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+#
+# File: executor.py
+# Analyzes the messages of the users in a pool of worker processes: the POS
+# tags, keywords, type, language and level of a sentence, and the FAQ entries
+# that match a conversation. The sessions wait for the analysis without
+# blocking each other. The analyzed sentences of all workers are kept in one
+# cache in the process of the sessions.
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# >>> executor.pool.start()
+# >>> sentence = await executor.pool.analyze("Where is the library?")
+# >>> faqs = await executor.pool.faqs(keywords, faq_file, "English", asked)
+# >>> executor.pool.info()
+
+# Imports
+import asyncio
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+from analysis import LRUCache
+from conversation import Sentence
+import knowledge
+import resources
+import search_faq
+from config import *
+
+
+def prepare():
+    """
+    Runs in every worker when it starts. Everything loaded before the pool was
+    started is already there, only the reloading of changed files is not.
+    """
+    resources.Reloader().start()
+
+
+def analyze_sentence(text, language=None):
+    """
+    Runs in a worker
+
+    Input
+        text: str
+        language: tuple of int and str, or None to detect it
+    Output
+        Sentence without a conversation, with the words of its utterance
+    """
+    sentence = Sentence(text, None, language)
+    # Tokenize here, so the process of the sessions does not have to
+    sentence.utterance.words
+    return sentence
+
+
+class AnalysisPool:
+    def __init__(self, workers=ANALYSIS_WORKERS, warn=ANALYSIS_QUEUE_WARN,
+                 cache=KEYWORD_CACHE_SIZE):
+        """
+        A pool of worker processes that analyze messages. Without workers
+        (or before it is started) the messages are analyzed in this process.
+        It counts the messages that wait for a worker.
+
+        The caches of analysis.py would be split over the workers, so the
+        sentences the workers analyzed are kept here, pickled so every
+        session gets its own copy. They are kept by the version of the
+        knowledge base, like the keyword cache.
+
+        Input
+            workers: the number of worker processes
+            warn: the number of waiting messages above which a warning is
+                printed
+            cache: the number of analyzed sentences that are kept
+        """
+        self.workers = workers
+        self.warn = warn
+        self.executor = None
+        self.sentences = LRUCache(cache)
+        self.lock = Lock()
+        self.submitted = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.time = 0.0
+
+    def start(self):
+        """
+        Start the workers. Start them after warming up, so they share what is
+        loaded, and before starting threads, which are not forked.
+        """
+        if self.workers < 1 or self.executor is not None:
+            return
+        self.executor = ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context('fork'),
+            initializer=prepare)
+        # All workers are forked at the first task
+        self.executor.submit(len, ()).result()
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def run(self, function, *args):
+        """
+        Run a function in a worker and wait for its result
+
+        Input
+            function: a function of a module, so a worker can find it
+            args: the arguments of the function, which are copied
+        Output
+            the result of the function, copied from the worker
+        """
+        if self.executor is None:
+            return function(*args)
+
+        start = time.perf_counter()
+        with self.lock:
+            self.submitted += 1
+            self.waiting += 1
+            if self.waiting > self.max_waiting:
+                self.max_waiting = self.waiting
+                if self.waiting > self.warn:
+                    print("%d messages wait for the analysis, consider more "
+                          "ANALYSIS_WORKERS" % self.waiting)
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                self.executor, function, *args)
+        except BrokenProcessPool:
+            # A worker died, analyze everything here from now on
+            self.broken()
+            return function(*args)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+                self.time += time.perf_counter() - start
+
+    def broken(self):
+        """
+        Stop the pool after a worker died. Every message that waited for a
+        worker gets here, but only the first one stops the pool.
+        """
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            print("An analysis worker died, the messages are analyzed in "
+                  "this process from now on")
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def analyze(self, text, language=None):
+        """
+        Input
+            text: str
+            language: tuple of int and str, or None to detect it
+        Output
+            Sentence without a conversation, see Sentence.set_conversation
+        """
+        if self.executor is None:
+            return analyze_sentence(text, language)
+        key = (text, language, knowledge.version())
+        found = self.sentences.get(key)
+        if found is None:
+            sentence = await self.run(analyze_sentence, text, language)
+            self.sentences.put(key, pickle.dumps(sentence))
+            return sentence
+        return pickle.loads(found)
+
+    async def faqs(self, keywords, file, language, asked_questions):
+        """
+        Input
+            keywords: keywords of the conversation
+            file: FAQ file of the language
+            language: language of the conversation
+            asked_questions: already asked questions in string format
+        Output
+            list of tuples of question and answer in FAQ and the keywords from
+            the question, best first
+        """
+        return await self.run(search_faq.get_faqs, set(keywords), file,
+                              language, list(asked_questions))
+
+    def info(self):
+        """
+        Output
+            dict with the number of 'workers', the number of 'submitted'
+            messages, the number 'waiting' now and at most ('max_waiting'),
+            the 'mean_time' from submitting until the result in seconds and
+            the info of the 'cache' of analyzed sentences
+        """
+        with self.lock:
+            done = self.submitted - self.waiting
+            return {'workers': self.workers if self.executor else 0,
+                    'submitted': self.submitted, 'waiting': self.waiting,
+                    'max_waiting': self.max_waiting,
+                    'mean_time': self.time/done if done else 0.0,
+                    'cache': self.sentences.info()}
+
+
+# The analysis of the messages of all sessions in this process
+pool = AnalysisPool()
@@ -0,0 +1,291 @@
+#!/usr/bin/python3
+#
+# File: knowledge.py
+# The knowledge base of the chatbot: the stopwords, the studies, faculties and
+# abbreviations of studies, and the YAML cores. All sources are compiled into
+# one binary snapshot, which is what sessions load.
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# ~ python3 knowledge.py
+# Compiles the snapshot. Loading an outdated or missing snapshot compiles it
+# as well.
+
+# Imports
+import ast
+import hashlib
+import os
+import pickle
+from types import MappingProxyType
+
+import nltk
+from ruamel.yaml import YAML
+
+import resources
+from config import *
+
+# Version of the snapshot format, increase it when the contents change
+SNAPSHOT_VERSION = 2
+
+# Files with the studies, faculties and abbreviations of studies
+EXTRACT = "extract_site/"
+STUDY_FILES = ['faculty_studies.txt', 'afk_en.txt', 'afk_nl.txt',
+               'faculties_eng.txt', 'faculties_dut.txt']
+STOPWORD_FILE = 'stopwoorden.txt'
+YAML_FILES = ['core_en.yml', 'core_nl.yml', 'additional_en.yml',
+              'additional_nl.yml']
+
+
+def read_all_stopwords():
+    """
+        Creates a dictionary with language as key and a set of all stopwords
+        for that given language.
+        For the Dutch nltk we add additional stopwords from a file
+    """
+    stopwords = {}
+    dutch_stopwords = set()
+    with open(STOPWORD_FILE) as f:
+        for line in f:
+            dutch_stopwords.add(line)
+    nltk_dutch = set(nltk.corpus.stopwords.words('dutch'))
+    stopwords['dutch'] = dutch_stopwords.union(nltk_dutch)
+    stopwords['english'] = set(nltk.corpus.stopwords.words('english'))
+    return stopwords
+
+
+def extract_from_file(filename):
+    with open(filename, 'r') as file:
+        reader = file.readlines()
+        all_lines = set([line for line in reader])
+    return all_lines
+
+
+def read_dict(filename):
+    abbr_dict = {}
+    with open(filename, 'r') as file:
+        reader = file.readlines()
+        dictstring = reader[0]
+        abbr_dict = ast.literal_eval(dictstring)
+    return abbr_dict
+
+
+def read_all_studies(extract=EXTRACT):
+    """
+        Creates a dictionary with the studies, the faculties and the
+        abbreviations of studies
+    """
+    studict = read_dict(extract+'faculty_studies.txt')
+
+    all_studies = set()
+    for value in studict.values():
+        for item in value:
+            all_studies.add(item)
+
+    faculty_studies = {}
+    faculty_studies['studies'] = all_studies
+
+    abbr_studies = read_dict(extract+'afk_en.txt')
+    abbr_studies = dict(abbr_studies,**(read_dict(extract+'afk_nl.txt')))
+
+    faculty_studies['abbr_stu'] = abbr_studies
+
+    faculties = extract_from_file(extract+'faculties_eng.txt')
+    faculties = faculties.union(extract_from_file(extract+'faculties_dut.txt'))
+
+    faculty_studies['faculties'] = faculties
+
+    # The normalized names the double bigram matching compares with
+    faculty_studies['clean_studies'] = [(" ".join([x for x in
+        nltk.word_tokenize(" ".join(item.lower().split("(")[:-1])) if
+        len(x) > 3 and "'" not in x]),item) for item in all_studies]
+    faculty_studies['clean_faculties'] = [(" ".join([x for x in
+        nltk.word_tokenize(item.lower()) if len(x) > 3 and "'" not in
+        x]),item) for item in faculties]
+
+    return faculty_studies
+
+
+def read_yaml(file):
+    """
+        Parse a YAML file into plain dictionaries and lists
+        Input:
+            file: str
+    """
+    with open(file) as y:
+        return YAML(typ='safe').load(y)
+
+
+def sources():
+    """
+        Output:
+            list of all files the snapshot is compiled from
+    """
+    return [STOPWORD_FILE] + [EXTRACT + file for file in STUDY_FILES] + \
+        YAML_FILES
+
+
+def digest(files):
+    """
+        Fingerprint of the contents of files, to know if a snapshot is
+        outdated
+        Input:
+            files: list of str
+        Output:
+            str
+    """
+    h = hashlib.sha1()
+    for file in files:
+        with open(file, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def compile_snapshot(path=SNAPSHOT):
+    """
+        Parse all sources and write them to the snapshot
+        Input:
+            path: file of the snapshot
+        Output:
+            the knowledge base: dict
+    """
+    files = sources()
+    data = {'stopwords': read_all_stopwords(),
+            'studies': read_all_studies(),
+            'yaml': {file: read_yaml(file) for file in YAML_FILES}}
+    snapshot = {'version': SNAPSHOT_VERSION, 'digest': digest(files),
+                'data': data}
+
+    # Write to a temporary file first, so a snapshot is never half written.
+    # Every process has its own, the workers may compile at the same time.
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, path)
+    return data
+
+
+def load_snapshot(path=SNAPSHOT):
+    """
+        Load the snapshot, compiling it first if it is missing or outdated
+        Input:
+            path: file of the snapshot
+        Output:
+            the knowledge base: dict
+    """
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot['version'] == SNAPSHOT_VERSION and \
+                snapshot['digest'] == digest(sources()):
+            return snapshot['data']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+    print("Compiling knowledge snapshot", path)
+    return compile_snapshot(path)
+
+
+def freeze_yaml(value):
+    """
+        Make a parsed YAML file read-only: dictionaries become read-only
+        mappings and lists become tuples
+        Input:
+            value: a parsed YAML file, or a part of it
+        Output:
+            the read-only value
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze_yaml(item) for key, item in
+                                 value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_yaml(item) for item in value)
+    return value
+
+
+def freeze(data):
+    """
+        Make the stopwords, the studies and the YAML cores read-only, so all
+        sessions can share them
+        Input:
+            data: the knowledge base: dict
+        Output:
+            the read-only knowledge base: dict
+    """
+    stopwords = MappingProxyType({language: frozenset(words) for
+                                  language, words in data['stopwords'].items()})
+    studies = data['studies']
+    studies = MappingProxyType({
+        'studies': frozenset(studies['studies']),
+        'abbr_stu': MappingProxyType(studies['abbr_stu']),
+        'faculties': frozenset(studies['faculties']),
+        'clean_studies': tuple(studies['clean_studies']),
+        'clean_faculties': tuple(studies['clean_faculties'])})
+    yaml = MappingProxyType({file: freeze_yaml(value) for file, value in
+                             data['yaml'].items()})
+    return MappingProxyType(dict(data, stopwords=stopwords, studies=studies,
+                                 yaml=yaml))
+
+
+# Loaded once per process, and again when a source changes. Not when the
+# snapshot changes: loading writes it, which would load everything twice.
+resources.register('knowledge', lambda: freeze(load_snapshot()), sources())
+
+
+def get(name):
+    """
+        Get a part of the knowledge base. It is shared by the whole process,
+        so it is never copied and should not be changed.
+        Input:
+            name: 'stopwords', 'studies' or 'yaml'
+    """
+    return resources.get('knowledge')[name]
+
+
+def version():
+    """
+        Output:
+            int that changes every time the knowledge base is reloaded
+    """
+    resources.get('knowledge')
+    return resources.version('knowledge')
+
+
+def get_stopwords(language):
+    """
+        Input: either 'dutch' or 'english'
+        Output: the stopwords for the desired language: frozenset
+    """
+    return get('stopwords')[language]
+
+
+def get_studies():
+    """
+        Output:
+            the studies and faculties (frozensets), their normalized names
+            (tuples of the normalized and the full name) and the
+            abbreviations of studies: read-only dict
+    """
+    return get('studies')
+
+
+def get_yaml(file):
+    """
+        Get a parsed YAML file, which is shared by all chatbots, so it is
+        read-only
+        Input:
+            file: str
+    """
+    data = get('yaml')
+    if file in data:
+        return data[file]
+    # Not part of the snapshot, parse it once
+    name = 'yaml:' + file
+    resources.register(name, lambda: freeze_yaml(read_yaml(file)), [file])
+    return resources.get(name)
+
+
+# Compile
+if __name__ == "__main__":
+    compile_snapshot()
+    print("Compiled", SNAPSHOT, "from", ", ".join(sources()))
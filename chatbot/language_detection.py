@@ -0,0 +1,394 @@
+#!/usr/bin/python3
+#
+# File: language_detection.py
+# Detects whether a text is Dutch or English
+# Copyright 2018
+# The Gerrit Group
+#
+
+# (Test) usage
+# ~ python3 language_detection.py "sentence"
+
+# ~ python3 language_detection.py --train
+# Trains the character trigram model on the YAML cores and the FAQ files.
+
+# ~ python3 language_detection.py --evaluate
+# Trains on 80% of the texts and prints the accuracy on the other 20%.
+
+# Imports
+import json
+import os
+import sys
+from collections import Counter
+import nltk
+import numpy as np
+import regex as re
+
+from config import *
+
+# The languages as (int, str), like in the rest of the chatbot
+DUTCH = (0, "Dutch")
+ENGLISH = (1, "English")
+LANGUAGES = [DUTCH, ENGLISH]
+
+# The texts the trigram model is trained on, by language
+CORPORA = {DUTCH: ['core_nl.yml', 'additional_nl.yml',
+                   'extract_site/export_faq_nl.txt'],
+           ENGLISH: ['core_en.yml', 'additional_en.yml',
+                     'extract_site/export_faq_en.txt']}
+
+# Number of buckets the trigrams are hashed into
+TRIGRAM_BUCKETS = 4096
+
+
+def words_of(text):
+    """
+        Input:
+            text: str
+        Output:
+            list of the lowercase words (only letters) of the text
+    """
+    return re.findall(r"[^\W\d_]+", text.lower())
+
+
+class WordListIdentifier:
+    def __init__(self, vocabulary):
+        """
+            Detects English by the share of words that are in an English
+            vocabulary
+            Source: https://stackoverflow.com/questions/3182268/nltk-and-language-detection
+            Input:
+                vocabulary: set of lowercase English words
+        """
+        self.vocabulary = frozenset(vocabulary)
+
+    def detect(self, text):
+        """
+            Define the language of a text (Dutch/English)
+            Input:
+                text: str
+            Output:
+                language: tuple of int and str
+        """
+        words = words_of(text)
+        diff = set(words).difference(self.vocabulary)
+        if not words or (len(diff) / len(words)) < 0.2:
+            return ENGLISH
+        return DUTCH
+
+
+class TrigramIdentifier:
+    def __init__(self, weights):
+        """
+            Detects the language with a model of the character trigrams of
+            each language. The trigrams are hashed into buckets.
+            Input:
+                weights: array of the log probabilities of the buckets, a row
+                    for every language in LANGUAGES
+        """
+        self.weights = np.asarray(weights, dtype=np.float32)
+
+    @staticmethod
+    def trigrams(texts, buckets=TRIGRAM_BUCKETS):
+        """
+            Get the character trigrams of many texts at once. Only letters are
+            kept, and every word is surrounded by spaces.
+            Input:
+                texts: list of str
+                buckets: int
+            Output:
+                tuple of an array with the text of every trigram and an array
+                with its bucket
+        """
+        cleaned = [' ' + re.sub(r"[\W\d_]+", ' ', text.lower()).strip() + ' '
+                   for text in texts]
+        # Texts are separated by 0, which can not be in a cleaned text
+        codes = np.frombuffer('\0'.join(cleaned).encode('utf-32-le'),
+                              dtype=np.uint32).astype(np.uint64)
+        if len(codes) < 3:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        texts = np.cumsum(codes == 0)[:-2]
+        valid = (codes[:-2] != 0) & (codes[1:-1] != 0) & (codes[2:] != 0)
+        trigrams = (codes[:-2]*1000003 + codes[1:-1])*1000003 + codes[2:]
+        return texts[valid], (trigrams[valid] % np.uint64(buckets)).astype(np.int64)
+
+    @classmethod
+    def train(cls, corpora, buckets=TRIGRAM_BUCKETS, alpha=0.1):
+        """
+            Train a model
+            Input:
+                corpora: dict of a language in LANGUAGES to a list of texts
+                buckets: int
+                alpha: count added to every bucket (additive smoothing)
+            Output:
+                TrigramIdentifier
+        """
+        weights = []
+        for lang in LANGUAGES:
+            _, trigrams = cls.trigrams(corpora[lang], buckets)
+            counts = np.bincount(trigrams, minlength=buckets) + alpha
+            weights.append(np.log(counts/np.sum(counts)))
+        return cls(np.array(weights))
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['weights'])
+
+    def scores(self, texts):
+        """
+            Score many texts at once
+            Input:
+                texts: list of str
+            Output:
+                array of the log probability of every text (columns) in
+                every language (rows)
+        """
+        index, trigrams = self.trigrams(texts, self.weights.shape[1])
+        return np.array([np.bincount(index, weights=weights[trigrams],
+                                     minlength=len(texts))
+                         for weights in self.weights])
+
+    def detect_many(self, texts):
+        """
+            Define the language of many texts (Dutch/English) with one
+            vectorized operation
+            Input:
+                texts: list of str
+            Output:
+                list of languages: tuples of int and str
+        """
+        if not len(texts):
+            return []
+        scores = self.scores(texts)
+        # English wins a tie, like a text without letters
+        english = scores[1] >= scores[0]
+        return [ENGLISH if e else DUTCH for e in english]
+
+    def detect(self, text):
+        """
+            Define the language of a text (Dutch/English)
+            Input:
+                text: str
+            Output:
+                language: tuple of int and str
+        """
+        return self.detect_many([text])[0]
+
+
+class LanguageIdentifier:
+    def __init__(self, trigrams, words, short=SHORT_TEXT, names=(NAME,)):
+        """
+            Detects texts of at most short words with a word list, because
+            they have too few trigrams, and longer texts with the trigram
+            model. Names (like the name of the chatbot) say nothing about the
+            language, so the trigram model does not see them.
+            Input:
+                trigrams: TrigramIdentifier
+                words: WordListIdentifier
+                short: int
+                names: list of str
+        """
+        self.trigrams = trigrams
+        self.words = words
+        self.short = short
+        self.names = frozenset(name.lower() for name in names)
+
+    def detect_many(self, texts):
+        """
+            Define the language of many texts (Dutch/English)
+            Input:
+                texts: list of str
+            Output:
+                list of languages: tuples of int and str
+        """
+        languages = [None] * len(texts)
+        long = []
+        for i, text in enumerate(texts):
+            words = words_of(text)
+            if len(words) <= self.short:
+                languages[i] = self.words.detect(text)
+            else:
+                long.append((i, " ".join(w for w in words
+                                         if w not in self.names)))
+        found = self.trigrams.detect_many([text for _, text in long])
+        for (i, _), language in zip(long, found):
+            languages[i] = language
+        return languages
+
+    def detect(self, text):
+        """
+            Define the language of a text (Dutch/English)
+            Input:
+                text: str
+            Output:
+                language: tuple of int and str
+        """
+        return self.detect_many([text])[0]
+
+
+def read_corpus(file):
+    """
+        Get the texts of a YAML core or an FAQ file
+        Input:
+            file: str
+        Output:
+            list of str
+    """
+    if file.endswith('.yml'):
+        import knowledge
+        texts = []
+        stack = [knowledge.read_yaml(file)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, dict):
+                stack += item.values()
+            elif isinstance(item, list):
+                stack += item
+            elif isinstance(item, str):
+                texts.append(item)
+        return texts
+    with open(file) as f:
+        datastore = json.load(f)
+    # Questions and answers, without HTML
+    return [re.sub("<.*?>", " ", text) for qa in datastore.values()
+            for text in qa]
+
+
+def train_model(path=LANGUAGE_MODEL):
+    """
+        Train the trigram model on CORPORA and save it
+        Input:
+            path: str
+        Output:
+            TrigramIdentifier
+    """
+    model = TrigramIdentifier.train(read_corpora(CORPORA))
+    model.save(path)
+    return model
+
+
+def word_list(corpora):
+    """
+        The word list identifier: the English vocabulary and the name of the
+        chatbot, without the words that more Dutch than English texts have
+        (like "nee", which the English core also understands)
+        Input:
+            corpora: dict of a language in LANGUAGES to a list of texts
+        Output:
+            WordListIdentifier
+    """
+    english_vocab = set(w.lower() for w in nltk.corpus.words.words())
+    counts = {lang: Counter(w for text in texts for w in set(words_of(text)))
+              for lang, texts in corpora.items()}
+    dutch = set(w for w, n in counts[DUTCH].items()
+                if n > counts[ENGLISH][w])
+    return WordListIdentifier((english_vocab - dutch) | {NAME.lower()})
+
+
+def read_corpora(corpora):
+    """
+        Input:
+            corpora: dict of a language to a list of files
+        Output:
+            dict of a language to a list of texts
+    """
+    return {lang: [text for file in files for text in read_corpus(file)]
+            for lang, files in corpora.items()}
+
+
+def evaluate(share=0.2, seed=0):
+    """
+        Train the identifier on the texts of CORPORA without a share of the
+        texts of every file, and print its accuracy on those. The YAML cores
+        are only trained on: they have the same words in both languages.
+        Input:
+            share: the share of the texts that is held out
+            seed: seed of the random split
+    """
+    import random
+
+    rng = random.Random(seed)
+    train = {lang: [] for lang in LANGUAGES}
+    test = []
+    for lang, files in CORPORA.items():
+        for file in files:
+            texts = read_corpus(file)
+            rng.shuffle(texts)
+            held = 0 if 'core' in file else int(len(texts)*share)
+            train[lang] += texts[held:]
+            test += [(text, lang) for text in texts[:held]]
+
+    identifier = LanguageIdentifier(TrigramIdentifier.train(train),
+                                    word_list(train))
+    found = identifier.detect_many([text for text, _ in test])
+    for name, short in [("short", True), ("long", False)]:
+        for lang in LANGUAGES:
+            results = [f == l for (text, l), f in zip(test, found)
+                       if l == lang and
+                       (len(words_of(text)) <= SHORT_TEXT) == short]
+            if results:
+                print("%s %s texts: %d held out, %.1f%% correct" %
+                      (name, lang[1], len(results),
+                       100*sum(results)/len(results)))
+
+
+_identifier = None
+
+
+def get_identifier():
+    """
+        The identifier of the process, loaded the first time. This is the
+        trigram model with the word list for short texts, or if the model is
+        not trained only the word list.
+        Output:
+            LanguageIdentifier or WordListIdentifier
+    """
+    global _identifier
+    if _identifier is None:
+        words = word_list(read_corpora(CORPORA))
+        if os.path.isfile(LANGUAGE_MODEL):
+            _identifier = LanguageIdentifier(
+                TrigramIdentifier.load(LANGUAGE_MODEL), words)
+        else:
+            _identifier = words
+    return _identifier
+
+
+def detect(text):
+    """
+        Define the language of a text (Dutch/English)
+        Input:
+            text: str
+        Output:
+            language: tuple of int and str
+    """
+    return get_identifier().detect(text)
+
+
+def detect_many(texts):
+    """
+        Define the language of many texts (Dutch/English)
+        Input:
+            texts: list of str
+        Output:
+            list of languages: tuples of int and str
+    """
+    identifier = get_identifier()
+    if isinstance(identifier, LanguageIdentifier):
+        return identifier.detect_many(texts)
+    return [identifier.detect(text) for text in texts]
+
+
+# Handle input
+if __name__ == "__main__":
+    if sys.argv[1:] == ['--train']:
+        train_model()
+        print("Trained", LANGUAGE_MODEL)
+    elif sys.argv[1:] == ['--evaluate']:
+        evaluate()
+    else:
+        print(detect(" ".join(sys.argv[1:]) or input("Text: ")))
@@ -0,0 +1,385 @@
+#!/usr/bin/python3
+#
+# File: level_matching.py
+# Indexes of the study and faculty names, to find the level (study or faculty)
+# of a sentence without comparing it with every name.
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# >>> indexes = level_matching.get_indexes()
+# >>> indexes['faculties'].match_string("faculty of science", NAIVE_THRESH)
+
+# Imports
+from collections import Counter
+
+import nltk
+import numpy as np
+
+import knowledge
+import resources
+from config import *
+
+
+def trigrams(text):
+    """
+    Input
+        text: str
+    Output
+        Counter of the character trigrams of the text
+    """
+    return Counter(text[i:i+3] for i in range(len(text) - 2))
+
+
+def clean_name(name):
+    """
+    The words of a study or faculty name that a keyword is matched with.
+    Whatever is between brackets at the end of the name is left out.
+
+    Input
+        name: str
+    Output
+        list of str
+    """
+    checklist = name.split("(")
+    s = len(checklist)
+    if len(checklist) > 1:
+        s = -1
+    return [x for x in nltk.word_tokenize("".join(checklist[:s]).lower())
+            if len(x) != 1 and "'" not in x and x != 'der']
+
+
+def bounded_edit_distance(a, b, limit):
+    """
+    The Levenshtein distance of two strings (like nltk's edit_distance), if
+    it is at most limit. Only the band of the table within limit of the
+    diagonal is computed.
+
+    Input
+        a: str
+        b: str
+        limit: int, at least 0
+    Output
+        the edit distance, or limit + 1 if it is larger than limit
+    """
+    over = limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return over
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over]*(len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        low, high = max(1, i - limit), min(len(b), i + limit)
+        char = a[i - 1]
+        for j in range(low, high + 1):
+            cost = previous[j - 1] + (char != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost if cost < over else over
+        if min(current[low - 1:high + 1]) >= over:
+            return over
+        previous = current
+    return previous[len(b)]
+
+
+class LevelIndex:
+    def __init__(self, names):
+        """
+        Index a list of study or faculty names
+
+        Input
+            names: iterable of str
+        """
+        self.names = list(names)
+        lowered = [name.lower() for name in self.names]
+        self.lengths = np.array([len(name) for name in self.names])
+        self.lowered_lengths = np.array([len(name) for name in lowered])
+
+        # Character trigrams (with counts) to names, in CSR format
+        self.trigram_rows = {}
+        postings = []
+        for i, name in enumerate(lowered):
+            for trigram, count in trigrams(name).items():
+                if trigram not in self.trigram_rows:
+                    self.trigram_rows[trigram] = len(postings)
+                    postings.append([])
+                postings[self.trigram_rows[trigram]].append((i, count))
+        self.indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(names) for names in postings])
+        self.indices = np.array([i for names in postings for i, _ in names],
+                                dtype=np.int64)
+        self.counts = np.array([c for names in postings for _, c in names],
+                               dtype=np.int64)
+
+        # Words of the clean names to the names that have them
+        self.clean_lengths = np.zeros(len(self.names))
+        self.words = {}
+        for i, name in enumerate(self.names):
+            clean = clean_name(name)
+            self.clean_lengths[i] = len(clean)
+            for word in set(clean):
+                self.words.setdefault(word, []).append(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    def common_trigrams(self, text):
+        """
+        Count the trigrams every name has in common with a text
+
+        Input
+            text: lowercase str
+        Output
+            array with the number of common trigrams of every name
+        """
+        query = [(self.trigram_rows[trigram], count) for trigram, count in
+                 trigrams(text).items() if trigram in self.trigram_rows]
+        if not query:
+            return np.zeros(len(self), dtype=np.int64)
+        rows = np.array([row for row, _ in query])
+        counts = np.array([count for _, count in query])
+        lengths = self.indptr[rows + 1] - self.indptr[rows]
+        positions = np.concatenate([np.arange(self.indptr[row],
+                                              self.indptr[row + 1])
+                                    for row in rows])
+        common = np.minimum(self.counts[positions], np.repeat(counts, lengths))
+        return np.bincount(self.indices[positions], weights=common,
+                           minlength=len(self)).astype(np.int64)
+
+    def match_string(self, text, thresh=NAIVE_THRESH):
+        """
+        Match a whole string with the names, scoring
+            1 - edit_distance/max(len(text), len(name))
+        Only names that can score above the threshold are compared: the edit
+        distance is at least the difference in length, and every edit
+        removes at most 3 common trigrams. The edit distance is only computed
+        up to the largest distance that still scores above the threshold.
+
+        Input
+            text: str
+            thresh: threshold whether a match is good enough
+        Output
+            best_matches: list of tuples of matched names and score
+        """
+        lowered = text.lower()
+        longest = np.maximum(self.lowered_lengths, len(lowered))
+        common = self.common_trigrams(lowered)
+        bound = np.maximum(np.abs(self.lowered_lengths - len(lowered)),
+                           np.ceil((longest - 2 - common)/3))
+        scale = np.maximum(self.lengths, len(text))
+        possible = 1 - bound/scale > thresh
+
+        best_matches = []
+        for i in np.flatnonzero(possible):
+            name = self.names[i]
+            # The largest edit distance that still scores above thresh
+            limit = int((1 - thresh)*scale[i]) + 1
+            while limit >= 0 and 1 - limit/scale[i] <= thresh:
+                limit -= 1
+            if limit < 0:
+                continue
+            points = bounded_edit_distance(lowered, name.lower(), limit)
+            score = 1-points/max(len(text),len(name))
+            if score > thresh:
+                best_matches.append((name,score))
+        return best_matches
+
+    def match_keywords(self, keywords, thresh=STUDY_THRESH):
+        """
+        Match keywords with the clean names, scoring the share of the words
+        of the clean name that are keywords
+
+        Input
+            keywords: list of keywords of the sentence
+            thresh: threshold whether a match is good enough
+        Output
+            best_matches: list of tuples of matched names and score
+        """
+        score = np.zeros(len(self))
+        for word in keywords:
+            for i in self.words.get(word, ()):
+                score[i] += 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            word_score = np.where(self.clean_lengths > 0,
+                                  score/self.clean_lengths, 0)
+        return [(self.names[i], float(word_score[i]))
+                for i in np.flatnonzero(word_score > thresh)]
+
+
+def encode(words, width):
+    """
+    Encode strings as a padded array of character codes
+
+    Input
+        words: list of str
+        width: number of columns, at least the longest word
+    Output
+        array with a row per word, padded with -1
+    """
+    codes = np.full((len(words), width), -1, dtype=np.int64)
+    for i, word in enumerate(words):
+        codes[i, :len(word)] = [ord(char) for char in word]
+    return codes
+
+
+def bigram_scores(word1, words2):
+    """
+    The double bigram score of one word with many words at once: the number
+    of characters of word1 that are in the other word at the same position,
+    or one position before or after (a max typographical error of 1)
+
+    Input
+        word1: array of character codes
+        words2: array of padded words (see encode)
+    Output
+        array of the score of every word
+    """
+    # Pad with -1 on both sides, so the positions before and after exist
+    width = max(words2.shape[1], len(word1)) + 2
+    padded = np.full((len(words2), width), -1, dtype=np.int64)
+    padded[:, 1:words2.shape[1] + 1] = words2
+    matched = np.zeros((len(words2), len(word1)), dtype=bool)
+    for k in range(3):
+        matched |= padded[:, k:k + len(word1)] == word1
+    return matched.sum(axis=1)
+
+
+def bigram_scores_reversed(words1, word2):
+    """
+    The double bigram score of many words with one word at once, like
+    bigram_scores with the roles of the words swapped
+
+    Input
+        words1: array of padded words (see encode)
+        word2: array of character codes
+    Output
+        array of the score of every word
+    """
+    # Pad with -2, which never matches a character or the padding of words1
+    width = words1.shape[1]
+    padded = np.full(width + 2, -2, dtype=np.int64)
+    padded[1:len(word2) + 1] = word2[:width + 1]
+    matched = np.zeros(words1.shape, dtype=bool)
+    for k in range(3):
+        matched |= words1 == padded[k:k + width]
+    return matched.sum(axis=1)
+
+
+class BigramIndex:
+    def __init__(self, clean_names):
+        """
+        The cleaned study or faculty names, encoded as arrays to match them
+        all at once with the double bigram approach
+
+        Input
+            clean_names: list of tuples of the cleaned and the full name
+        """
+        self.names = [name for _, name in clean_names]
+        self.lengths = np.array([len(clean) for clean, _ in clean_names])
+        self.name_lengths = np.array([len(name.split("(")[0])
+                                      for name in self.names])
+
+        # Every name without its first h words, for every h
+        suffixes, self.suffix_starts = [], []
+        # Every single word of a name
+        words, self.word_starts = [], []
+        for clean, _ in clean_names:
+            split = clean.lower().split(" ")
+            self.suffix_starts.append(len(suffixes))
+            suffixes += ["".join(split[h:]) for h in range(len(split))]
+            self.word_starts.append(len(words))
+            words += split
+        width = max([len(word) for word in suffixes] + [1])
+        self.suffixes = encode(suffixes, width)
+        self.words = encode(words, width)
+        self.word_lengths = np.array([len(word) for word in words])
+
+    def __len__(self):
+        return len(self.names)
+
+    def scores(self, checkstring, thresh=BIGRAM_THRESH):
+        """
+        Score a combination of input with every name, like the double bigram
+        of one name at a time did (see benchmark.bigram_kernel)
+
+        Input
+            checkstring: string of a given combination of input
+            thresh: threshold whether a match is good enough
+        Output
+            array of the score of every name
+        """
+        check = np.array([ord(char) for char in checkstring.lower()],
+                         dtype=np.int64)
+
+        # Best match of the input with the end of the name
+        mscore = np.maximum.reduceat(bigram_scores(check, self.suffixes),
+                                     self.suffix_starts)
+
+        # Test if one of the words of the name is actually in the query, the
+        # first best word counts
+        tscore = bigram_scores_reversed(self.words, check)
+        best = np.maximum.reduceat(tscore, self.word_starts)
+        owner = np.repeat(np.arange(len(self)), np.diff(
+            self.word_starts + [len(tscore)]))
+        first = np.where((tscore == best[owner]) & (tscore > 0),
+                         np.arange(len(tscore)), len(tscore))
+        first = np.minimum.reduceat(first, self.word_starts)
+        found = first < len(tscore)
+        ratio = np.zeros(len(self))
+        ratio[found] = tscore[first[found]]/self.word_lengths[first[found]]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(ratio > thresh, mscore/self.name_lengths, 0)
+
+    def double_bigram(self, keywords, thresh=BIGRAM_THRESH):
+        """
+        Match every combination of consecutive keywords with the names using
+        a max typographical error distance of 1
+
+        Input
+            keywords: list of keywords of the sentence
+            thresh: threshold whether a match is good enough
+        Output
+            best_matches: list of tuples of matched names and score
+        """
+        best_matches = []
+        for i in range(len(keywords)):
+            checkstring = ""
+            for j in range(i, len(keywords)):
+                checkstring += keywords[j]
+                scores = self.scores(checkstring, thresh)
+                good = (len(checkstring)*thresh < self.lengths) & \
+                    (scores > thresh)
+                best_matches += [(self.names[k], float(scores[k]))
+                                 for k in np.flatnonzero(good)]
+        return best_matches
+
+
+def build_indexes():
+    """
+    Output
+        dict with a LevelIndex of the 'studies' and of the 'faculties', and
+        a BigramIndex of the 'clean_studies' and the 'clean_faculties'
+    """
+    studies = knowledge.get_studies()
+    return {'studies': LevelIndex(studies['studies']),
+            'faculties': LevelIndex(studies['faculties']),
+            'clean_studies': BigramIndex(studies['clean_studies']),
+            'clean_faculties': BigramIndex(studies['clean_faculties'])}
+
+
+# Built once per process, and again when the knowledge base changes
+resources.register('levels', build_indexes, depends=['knowledge'])
+
+
+def get_indexes():
+    """
+    Output
+        dict with a LevelIndex of the 'studies' and of the 'faculties', and
+        a BigramIndex of the 'clean_studies' and the 'clean_faculties'
+    """
+    return resources.get('levels')
@@ -2,8 +2,11 @@
 #
 # File: main_algorithm.py
 # The main algorithm that the chatbot follows.
-# Note that it's technically recursive, but only returns True on its way back
-# up.
+# The flowchart is a state machine: the state is the question the chatbot
+# waits for the user to answer. Every answer is one step, which follows the
+# flowchart until the chatbot asks the next question, so the stack never grows
+# during a conversation. The state only holds plain values, so a waiting
+# conversation can be stored (see sessions.py).
 # The process flowchart is a great help in understanding this structure.
 #
 # Copyright 2018
@@ -13,31 +16,36 @@
 # Because of socketio, can only be run with the run.py file.
 
 # Import files
-from conversation import Conversation, Sentence
+from conversation import Conversation
 from chatbot import Chatbot
 from intelligent_unit import IU
+import executor
 
 # Import module
+import asyncio
 import sys
 
 class Main:
-    def __init__(self, socketio, session):
+    def __init__(self, socketio, session, log=True):
         """
         Input
             socketio - Flask SocketIO object
             session - request ID
+            log - whether the conversation is written to a log file
         """
-        self.cb = Chatbot(socketio, session)
+        self.cb = Chatbot(socketio, session, log=log)
         self.socket = socketio
         self.session = session
         self.iu = None
         self.conv = None
+        self.state = None
         self.already_running = False
 
-    def run(self):
+    async def run(self):
         """
         Starts up the chatbot with SocketIO and begins the execution of the main
-        algorithm. Also greets the user.
+        algorithm. Also greets the user, unless the conversation already
+        started.
 
         Output
             True - if the algorithm's execution finished correctly
@@ -46,58 +54,109 @@ class Main:
         if self.already_running:
             return False
         self.already_running = True
-        self.cb.greet()
-        main_complete = self.continue_at_input()
-        if not main_complete:
-            raise RuntimeError("Error in logical structure: "\
-            "continue_at_input should always return True.")
-        return main_complete
+        if self.state is None:
+            self.cb.greet()
+            self.wait('input')
+        while self.state[0] != 'done':
+            answer = await self.cb.user_input()
+            await self.step(answer)
+        return True
+
+    def attach(self, socket):
+        """
+        Connect a stored conversation to the socket again
+
+        Input
+            socket - Flask SocketIO object
+        """
+        self.socket = socket
+        self.cb.attach(socket)
+
+    def __getstate__(self):
+        """
+        The conversation without the socket, to store it while it waits for
+        the user (see sessions.py)
+        """
+        state = self.__dict__.copy()
+        state['socket'] = None
+        state['already_running'] = False
+        return state
+
+    def wait(self, state, *args):
+        """
+        Wait for the user to answer. The answer is handled by the on_<state>
+        function, with args.
+
+        Input
+            state - str: 'input', 'faq', 'level', 'level_type', 'level_info',
+                'keyword', 'add_keyword', 'end', 'finish' or 'done' (the
+                conversation is over)
+            args - plain values (str, bool, list, dict, tuple)
+        """
+        self.state = (state,) + args
 
-    def continue_at_input(self, old_conv=False, old_iu=False):
+    async def step(self, answer):
+        """
+        Handle an answer of the user, following the flowchart until the
+        chatbot waits for the next answer
+
+        Input
+            answer - str
+        """
+        state, args = self.state[0], self.state[1:]
+        self.state = None
+        await getattr(self, 'on_' + state)(answer, *args)
+        if self.state is None:
+            raise RuntimeError("Error in logical structure: the " + state +
+                               " step should always wait for a new answer.")
+
+    async def on_input(self, answer, old_conv=False, old_iu=False):
         """
         Continues the chatbot at the "input" phase. (see process flowchart)
 
         Input
+            answer - the input of the user
             old_conv - If True, old Conversation object is kept. If not set, a
                 new one's started.
             old_iu - if True, old IU object is kept. If not set, a new IU is
                 initialized.
         """
-        answer = self.cb.user_input()
         if not old_iu:
             self.iu = IU()
+        # Analyzed by a worker, while other sessions go on
+        sentence = await executor.pool.analyze(answer)
         if not old_conv:
-            self.conv = Conversation(answer)
+            self.conv = Conversation(answer, sentence)
         else:
             # If this is a rephrase, add it to the conversation as well
-            self.conv.add_rephrase(answer)
+            self.conv.add_rephrase(answer, sentence)
         self.cb.set_language(self.conv.get_main_language())
         # Continue to the chatter phase.
-        if self.continue_at_chatter():
-            return True
-        raise RuntimeError("Error in logical structure, new input should be "\
-        "followed by checking chat database.")
+        await self.continue_at_chatter()
 
-    def continue_at_chatter(self):
+    async def continue_at_chatter(self):
         """
         Continues the chatbot at the "match chat DB" phase, and moves through
         checking the FAQ and sending to the backend. (see process flowchart)
         """
         # Chatter phase
-        self.chatter()
+        if self.chatter():
+            return
         # FAQ phase
-        if self.check_faq():
-            if self.end_conversation():
-                return True
-        # Backend phase
-        self.call_database()
-        # Then continue at viability check
-        if self.continue_at_viability_check():
-            return True
-        raise RuntimeError("Error in logical structure, backend check should "\
-        "always move on to viability check.")
+        faqs = await self.cb.match_faq(self.conv.get_conversation_keywords())
+        if self.check_faq(faqs):
+            return
+        await self.continue_at_backend()
 
-    def continue_at_viability_check(self, back=False):
+    async def continue_at_backend(self):
+        """
+        Continues the chatbot at the "backend" phase, and moves on to the
+        viability check. (see process flowchart)
+        """
+        await self.call_database()
+        await self.continue_at_viability_check()
+
+    async def continue_at_viability_check(self, back=False):
         """
         Continues the chatbot at the "viabililty check" phase (see proces flowchart)
 
@@ -111,18 +170,14 @@ class Main:
         url, answer = self.iu.get_winner()
         if url is not None:
             self.cb.link_and_answer(url, answer)
-            if self.end_conversation():
-                return True
-            self.iu.remove_url(url)
+            # If the conversation goes on, the IU chooses what is next
+            self.end_conversation('iu_choice', url)
         elif back:
-            if self.continue_at_chatter():
-                return True
-        if self.continue_at_iu_choice():
-            return True
-        raise RuntimeError("Error in logical structure, failed viability check "\
-        "should always move on to the IU choice.")
+            await self.continue_at_chatter()
+        else:
+            await self.continue_at_iu_choice()
 
-    def continue_at_iu_choice(self):
+    async def continue_at_iu_choice(self):
         """
         Continues the chatbot at the IU choice step (see proces flowchart).
         Depending on the IU's choice, one of five different courses of action
@@ -140,30 +195,23 @@ class Main:
             if self.iu.get_confirmed_level() is not None:
                 raise ValueError("NOTE TO DEV: IU shouldn't choose confirm level "\
                 "once it's already confirmed!")
-            if self.check_level():
-                return True
-            if self.continue_at_iu_choice():
-                return True
+            self.check_level()
         elif action == 2:
             # TODO same
             if self.iu.keyword_done(keyword):
                 raise ValueError("NOTE TO DEV: IU shouldn't choose a confirmed"\
                 " keyword!")
-            if self.check_keyword(keyword):
-                return True
-            if self.continue_at_chatter():
-                return True
+            self.check_keyword(keyword)
         elif action == 3:
-            if self.add_keyword():
-                return True
+            self.add_keyword()
         elif action == 4:
             self.cb.rephrase()
-            if self.continue_at_input(old_conv=True, old_iu=True):
-                return True
+            self.wait('input', True, True)
         elif action == 5:
-            return self.desperate_measures()
-        raise RuntimeError("Error in logical structure, one of the UI outcomes or "\
-        "the UI choice itself is misbehaving.")
+            await self.desperate_measures()
+        else:
+            raise RuntimeError("Error in logical structure, one of the UI "\
+            "outcomes or the UI choice itself is misbehaving.")
 
     def chatter(self):
         """
@@ -178,47 +226,60 @@ class Main:
             self.conv - Conversation object for tracking the conversation
 
         Output
-            False if no chat match was found, True when finishing up the program
-            recursively.
+            False if no chat match was found, True if the chatbot answered and
+            waits for new input.
         """
         if self.cb.get_last_input() != self.conv.get_last_sentence().get_string():
             return False
-        add = self.cb.match_additional(self.conv.get_conversation_keywords(), self.conv.get_last_sentence().get_string())
+        add = self.cb.match_additional(self.conv.get_conversation_keywords(), self.conv.get_last_sentence())
         if add is None:
-            add = self.cb.match_additional(self.conv.get_last_sentence().get_keywords(), self.conv.get_last_sentence().get_string())
+            add = self.cb.match_additional(self.conv.get_last_sentence().get_keywords(), self.conv.get_last_sentence())
         if add is not None:
             self.cb.answer(add)
             sentence = self.conv.get_last_sentence()
             self.conv.remove_conversation_keywords(sentence)
-            if self.continue_at_input(old_conv=True, old_iu=True):
-                return True
+            self.wait('input', True, True)
+            return True
         return False
 
-    def check_faq(self):
+    def check_faq(self, faqs):
         """
-        Checks the FAQ database and interacts with the user for confirmation.
+        Proposes the first of the matching questions from the FAQ to the user.
+        At most FAQ_MATCHES questions from the FAQ are proposed.
 
+        Input
+            faqs - list of questions and answers from the FAQ, best first
         Uses
-            self.cb - Chatbot object for matching and user interaction
-            self.conv - Conversation object to get the keywords from
+            self.cb - Chatbot object for user interaction
 
         Output
-            True if the right answer was found
-            False if no answer or a wrong answer was found
-        """
-        faq = self.cb.match_faq(self.conv.get_conversation_keywords())
-        if faq is not None:
-            self.cb.confirm(faq[0])
-            answer = self.cb.user_input()
-            if self.cb.is_confirmation(answer):
-                self.cb.answer(faq[1])
-                return True
-        return False
+            True if a question was proposed
+            False if there are no questions left
+        """
+        if not faqs:
+            return False
+        self.cb.ask_faq(faqs[0])
+        self.wait('faq', list(faqs))
+        return True
 
-    def call_database(self):
+    async def on_faq(self, answer, faqs):
+        """
+        The user answered whether the first of faqs is their question. If not,
+        the next one is proposed, and after the last one the backend is
+        called.
+        """
+        if self.cb.is_confirmation(answer):
+            self.cb.answer(faqs[0][1])
+            # If the conversation goes on, the backend is called
+            self.end_conversation('backend')
+        elif not self.check_faq(faqs[1:]):
+            await self.continue_at_backend()
+
+    async def call_database(self):
         """
         Calls the backend using the agreed dictionary, and stores the gained list
-        of dictionaries corresponding to URLs.
+        of dictionaries corresponding to URLs. The other sessions go on while
+        the backend answers.
 
         Uses
             self.cb - Chatbot object for calling the backend
@@ -226,7 +287,7 @@ class Main:
             self.iu - IU object for storing the output
         """
         server_dict = self.conv.get_server_dictionary()
-        output_dicts = self.cb.call_server(server_dict)
+        output_dicts = await asyncio.to_thread(self.cb.call_server, server_dict)
         print("output scores and links:")
         for o_dict in output_dicts:
             print(o_dict["Score"])
@@ -240,40 +301,35 @@ class Main:
 
     def check_level(self):
         """
-        Sets the level of the conversation based on user interaction.
-        There are two possible outcomes:
-        1. Nothing changes, the function above this can continue
-        2. The level changes, now we need to check if there's a winning link
+        Sets the level of the conversation based on user interaction. If the
+        conversation has a level, the user is asked to confirm it, otherwise
+        whether they mean a specific study.
 
         Uses
             self.cb - Chatbot object for user interaction
             self.conv - Conversation object for setting the level
-            self.iu - IU object for removing wrong URLs
         """
         level = self.conv.get_level()
         if level is not None:
             self.cb.confirm(level)
-            answer = self.cb.user_input()
-            if self.cb.is_confirmation(answer):
-                self.iu.level_change(level)
-                # Option 1
-                return False
-        answer = self.level_confirm('s')
-        if self.cb.is_confirmation(answer):
-            self.level_info('s')
+            self.wait('level', level)
         else:
-            answer = self.level_confirm('f')
-            if self.cb.is_confirmation(answer):
-                self.level_info('f')
-            else:
-                self.conv.set_level("UvA")
-                self.iu.level_change("UvA")
-        # Option 2
-        if self.continue_at_viability_check(back=True):
-            return True
-        raise RuntimeError("Error in logical structure: "\
-        "continue_at_viabicursor: pointer;lity_check did not return True.")
+            self.level_confirm('s')
 
+    async def on_level(self, answer, level):
+        """
+        The user answered whether level is the level of the conversation.
+        There are two possible outcomes:
+        1. Nothing changes, the IU chooses again
+        2. The user is asked for the type of level
+        """
+        if self.cb.is_confirmation(answer):
+            self.iu.level_change(level)
+            # Option 1
+            await self.continue_at_iu_choice()
+        else:
+            # Option 2
+            self.level_confirm('s')
 
     def level_confirm(self, level):
         """
@@ -283,8 +339,6 @@ class Main:
             level - character representing the level
         Uses:
              self.cb - chatbot object for user interaction
-        Output:
-            the user's response (string)
         """
         if self.cb.get_language()[0] == 0:
             if level == 's':
@@ -297,17 +351,29 @@ class Main:
             elif level == 'f':
                 self.cb.confirm("a specific faculty")
         # You can add responses for more languages here
-        return self.cb.user_input()
+        self.wait('level_type', level)
+
+    async def on_level_type(self, answer, level):
+        """
+        The user answered whether their question is about a specific study
+        ('s') or faculty ('f'). If it is about neither, the level is the UvA,
+        and we need to check if there's a winning link.
+        """
+        if self.cb.is_confirmation(answer):
+            self.level_info(level)
+        elif level == 's':
+            self.level_confirm('f')
+        else:
+            self.conv.set_level("UvA")
+            self.iu.level_change("UvA")
+            await self.continue_at_viability_check(back=True)
 
     def level_info(self, level):
         """
-        Specifically asks the user for the study/faculty and stores this.
-        Repeat if unclear.
+        Specifically asks the user for the study/faculty.
 
         Uses:
             self.cb - Chatbot object for user interaction
-            self.conv - Cnversation object for saving the level
-            self.iu - IU object so that URLs with wrong levels can be removed
         Input:
             level - character representing the level
         """
@@ -321,69 +387,95 @@ class Main:
                 self.cb.level("faculteit")
             elif self.cb.get_language()[0] == 1:
                 self.cb.level("faculty")
-        study = self.cb.user_input()
-        temp_sentence = Sentence(study, self.conv)
+        self.wait('level_info', level)
+
+    async def on_level_info(self, answer, level):
+        """
+        The user named their study/faculty. Stores this, and checks if there's
+        a winning link now. Repeat if unclear.
+
+        Uses:
+            self.cb - Chatbot object for user interaction
+            self.conv - Cnversation object for saving the level
+            self.iu - IU object so that URLs with wrong levels can be removed
+        """
+        temp_sentence = await executor.pool.analyze(answer)
         new_level = temp_sentence.get_level()
         if new_level is not None:
             self.conv.set_level(new_level)
             self.iu.level_change(new_level)
+            await self.continue_at_viability_check(back=True)
         else:
             self.cb.repeat()
             self.level_info(level)
 
     def check_keyword(self, keyword):
         """
-        Asks the user if the keyword has to do with their query. If so, it gets
-        confirmed in the IU class and this function returns False, if not, it gets
-        removed from the conversation, and the algorithm continues at the viability
-        check with back=True (see explanation there).
+        Asks the user if the keyword has to do with their query.
 
         Input:
             keyword - string, the keyword in question
+        Uses:
+            self.cb - Chatbot object for user interaction
+        """
+        self.cb.confirm(keyword)
+        self.wait('keyword', keyword)
+
+    async def on_keyword(self, answer, keyword):
+        """
+        If the keyword has to do with the query, it gets confirmed in the IU
+        class and the algorithm continues at the chatter phase, if not, it gets
+        removed from the conversation, and the algorithm continues at the
+        viability check with back=True (see explanation there).
+
         Uses:
             self.cb - Chatbot object for user interaction
             self.conv - Conversation object for keeping track of keywords
             self.iu - IU object for keeping track of confirmed keywords
         """
-        self.cb.confirm(keyword)
-        answer = self.cb.user_input()
         if self.cb.is_confirmation(answer):
             self.iu.keyword_change(keyword)
-            return False
+            await self.continue_at_chatter()
+            return
         self.iu.keyword_change(keyword, remove=True)
         self.conv.remove_conversation_keywords(keyword)
-        if self.continue_at_viability_check(back=True):
-            return True
-        raise RuntimeError("Error in logical structure: "\
-        "continue_at_viability_check did not return True.")
+        await self.continue_at_viability_check(back=True)
 
     def add_keyword(self):
         """
-        Asks the user for a keyword and stores this. If it's new information, moves
-        back to the chatter phase to do another FAQ check and database call,
-        otherwise goes back to the IU phase.
+        Asks the user for a keyword.
+
+        Uses:
+            self.cb - Chatbot object for user interaction
+        """
+        self.cb.user_keyword()
+        self.wait('add_keyword')
+
+    async def on_add_keyword(self, answer):
+        """
+        Stores the keyword of the user. If it's new information, moves back to
+        the chatter phase to do another FAQ check and database call, otherwise
+        goes back to the IU phase. A keyword of more than one word is asked
+        again.
 
         Uses:
             self.cb - Chatbot object for user interaction
             self.conv - Conversation object for getting and storing keywords
             self.iu - IU object to keep track of confirmed keywords
         """
-        self.cb.user_keyword()
-        keyword = self.cb.user_input().lower()
+        keyword = answer.lower()
         if ' ' in keyword:
             self.cb.wrong_keyword()
             self.add_keyword()
+            return
         self.iu.keyword_change(keyword)
         if keyword in self.conv.get_conversation_keywords():
-            if self.continue_at_iu_choice():
-                return True
+            await self.continue_at_iu_choice()
+            return
         self.conv.set_conversation_keywords(keyword)
-        if self.continue_at_chatter():
-            return True
-        raise RuntimeError("Error in logical structure: "\
-        "continue_at_chatter did not return True.")
+        await self.continue_at_chatter()
 
-    def desperate_measures(self):
+    async def desperate_measures(self):
         """
         Desperate measures, for if a right answer can't be found by the other
         functions. Feel free to change this to your own ideas for extra
@@ -394,57 +486,110 @@ class Main:
         bestish_URL, bestish_answer = self.iu.get_winner(highest=True)
         if bestish_URL is not None:
             self.cb.link_and_answer(bestish_URL, bestish_answer)
-            if self.end_conversation():
-                return True
-            self.iu.remove_url(bestish_URL)
-        # As a last effort, let's ask every link from the backend that wasn't
-        # asked yet.
-        server_dict = self.conv.get_server_dictionary()
-        output_dicts = self.cb.call_server(server_dict)
-        for a_dict in output_dicts:
+            # If the conversation goes on, the backend links are tried
+            self.end_conversation('desperate', bestish_URL)
+            return
+        await self.try_backend_links()
+
+    async def try_backend_links(self, output_dicts=None):
+        """
+        As a last effort, let's ask every link from the backend that wasn't
+        asked yet. If even that fails, ask for a rephrase, but now clear the
+        conversation and iu.
+
+        Input:
+            output_dicts - the links from the backend that are left, None to
+                call the backend
+        """
+        if output_dicts is None:
+            server_dict = self.conv.get_server_dictionary()
+            output_dicts = await asyncio.to_thread(self.cb.call_server,
+                                                   server_dict)
+        for i, a_dict in enumerate(output_dicts):
             poss_url = a_dict["URL"]
             poss_answer = a_dict["Answer"]
             if poss_url not in self.iu.get_wrong_urls():
                 self.cb.link_and_answer(poss_url, poss_answer)
-                if self.end_conversation():
-                    return True
-                self.iu.remove_url(poss_url)
-        # If even that fails, ask for a rephrase, but now clear the conversation
-        # and iu. 
+                # If the conversation goes on, the next links are tried
+                self.end_conversation('backend_links', poss_url,
+                                      list(output_dicts[i + 1:]))
+                return
         self.cb.rephrase()
-        if self.continue_at_input():
-            return True
+        self.wait('input')
 
-    def end_conversation(self):
+    def end_conversation(self, *then):
         """
         Asks the user if the conversation's over.
-        There are three possible outcomes:
-            - Conversation's over, program ends. (by returning True)
-            - New conversation (i.e. with new question) is started
-            - Returns False, so that the conversation can continue where it left off
 
+        Input:
+            then - where the conversation continues if it isn't over:
+                ('backend',) - the backend phase
+                ('iu_choice', url) - the IU choice, without url
+                ('desperate', url) - the backend links, without url
+                ('backend_links', url, output_dicts) - the rest of the backend
+                    links, without url
         Uses
             self.cb - Chatbot object for user interaction
         """
         self.cb.confirm()
-        answer = self.cb.user_input()
-        if not self.cb.is_confirmation(answer):
-            return False
-        self.cb.finish()
-        answer = self.cb.user_input()
+        self.wait('end', *then)
+
+    async def on_end(self, answer, *then):
+        """
+        There are two possible outcomes:
+            - Conversation's over, the user is asked if they have a new
+              question
+            - The conversation continues where it left off (see
+              end_conversation)
+        """
+        if self.cb.is_confirmation(answer):
+            self.cb.finish()
+            self.wait('finish')
+        elif then[0] == 'backend':
+            await self.continue_at_backend()
+        elif then[0] == 'iu_choice':
+            self.iu.remove_url(then[1])
+            await self.continue_at_iu_choice()
+        elif then[0] == 'desperate':
+            self.iu.remove_url(then[1])
+            await self.try_backend_links()
+        elif then[0] == 'backend_links':
+            self.iu.remove_url(then[1])
+            await self.try_backend_links(then[2])
+
+    async def on_finish(self, answer):
+        """
+        The user answered if they have a new question.
+        There are three possible outcomes:
+            - Conversation's over, program ends.
+            - New conversation (i.e. with new question) is started
+            - Neither, a new conversation starts at the next input
+        """
         answer_confirm = self.cb.is_confirmation(answer)
         if answer_confirm is None:
-            if self.continue_at_input():
-                return True
+            self.wait('input')
         elif answer_confirm:
             self.cb.new_question()
-            if self.continue_at_input():
-                return True
-        self.cb.bye()
-        return True
+            self.wait('input')
+        else:
+            self.cb.bye()
+            self.wait('done')
 
     # Some get functions in case you need them
 
+    def set_language(self, lang):
+        """
+        The user chose a language
+
+        Input
+            lang - 1 for English, otherwise Dutch
+        """
+        language = (lang, 'English') if lang == 1 else (lang, 'Dutch')
+        self.cb.set_language(language)
+        if self.conv is not None:
+            self.conv.set_main_language(language)
+        self.cb.user_set_language()
+
     def get_chatbot(self):
         return self.cb
 
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+#
+# File: resources.py
+# The process-wide registry of data that is read from files, like the FAQ
+# indexes and the YAML cores, and the service that reloads it when the files
+# change.
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# >>> resources.register('name', loader, ['file.txt'])
+# >>> resources.get('name')
+# >>> resources.version('name')
+# The loader is called once, and again only when file.txt changes while a
+# Reloader is running.
+
+# Imports
+import os
+import time
+import traceback
+from threading import Thread, RLock
+
+from config import *
+
+
+class Resource:
+    def __init__(self, name, loader, paths=(), depends=()):
+        """
+        A value that is loaded from files
+
+        Input
+            name: str
+            loader: function without arguments that returns the value
+            paths: the files the value is loaded from
+            depends: names of the resources the loader uses
+        """
+        self.name = name
+        self.loader = loader
+        self.paths = list(paths)
+        self.depends = list(depends)
+        self.value = None
+        self.loaded = False
+        self.stamps = None
+        # The number of times the value was loaded
+        self.version = 0
+
+    def get_stamps(self):
+        """
+        Output:
+            the modification times of the files (None for a missing file)
+        """
+        stamps = []
+        for path in self.paths:
+            try:
+                stamps.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    def changed(self):
+        """
+        Output:
+            bool: whether a file changed since the value was loaded
+        """
+        return self.loaded and self.get_stamps() != self.stamps
+
+    def load(self):
+        """
+        Load the value and replace the old one in one assignment, so users
+        that hold the old value can keep using it.
+        """
+        stamps = self.get_stamps()
+        value = self.loader()
+        self.value = value
+        self.stamps = stamps
+        self.loaded = True
+        self.version += 1
+        return value
+
+
+# All resources by name, in the order they were registered
+_resources = {}
+_lock = RLock()
+
+
+def register(name, loader, paths=(), depends=()):
+    """
+    Register a resource, if there is none with the name yet
+
+    Input
+        name: str
+        loader: function without arguments that returns the value
+        paths: the files the value is loaded from
+        depends: names of the resources the loader uses, these are reloaded
+            first
+    """
+    if name in _resources:
+        return
+    with _lock:
+        if name not in _resources:
+            for dependency in depends:
+                if dependency not in _resources:
+                    raise ValueError("Resource " + name + " depends on " +
+                                     dependency + ", which is not registered")
+            _resources[name] = Resource(name, loader, paths, depends)
+
+
+def get(name):
+    """
+    Get the current value of a resource, loading it the first time
+
+    Input
+        name: str
+    Output
+        the value
+    """
+    resource = _resources[name]
+    if not resource.loaded:
+        with _lock:
+            if not resource.loaded:
+                resource.load()
+    return resource.value
+
+
+def version(name):
+    """
+    Input
+        name: str
+    Output
+        the number of times the resource was loaded, so what is computed from
+        it can be kept by version and is not used after a reload
+    """
+    return _resources[name].version
+
+
+def reload(force=False):
+    """
+    Reload the resources of which a file or a dependency changed
+
+    Input
+        force: reload every loaded resource
+    Output
+        list of the names of the reloaded resources
+    """
+    reloaded = []
+    with _lock:
+        for name, resource in list(_resources.items()):
+            if not resource.loaded:
+                continue
+            if force or resource.changed() or \
+                    any(dependency in reloaded for dependency in resource.depends):
+                try:
+                    resource.load()
+                except Exception:
+                    # Keep the old value and try again next time, the files
+                    # may still be being written
+                    traceback.print_exc()
+                    resource.stamps = None
+                    continue
+                reloaded.append(name)
+    return reloaded
+
+
+class Reloader(Thread):
+    def __init__(self, interval=RELOAD_INTERVAL):
+        """
+        A background service that checks the files of the resources every
+        interval seconds, and reloads the resources of the files that changed
+
+        Input
+            interval: float
+        """
+        Thread.__init__(self, name="reloader", daemon=True)
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            reloaded = reload()
+            if reloaded:
+                print("Reloaded", ", ".join(reloaded))
@@ -7,17 +7,36 @@
 #
 # (Test) usage
 # ~ python3 run.py
+# ~ python3 run.py --workers 4
 
 # Imports
 import eventlet
 eventlet.monkey_patch(socket=True)
 from flask import Flask, render_template, request
 from flask_socketio import SocketIO
+import argparse
 import logging
 import os
-
-from main_algorithm import Main
-from threading import Thread
+import time
+
+import nltk
+
+from sessions import SessionEngine
+from conversation import Conversation
+import knowledge
+import language_detection
+import level_matching
+import search_faq
+import search_additional
+import confirmation
+import resources
+import executor
+import workers
+from config import *
+
+# Sentences that are run through a Conversation before the server starts
+WARM_UP = ["Where can I find the schedule of Artificial Intelligence?",
+           "Waar kan ik het rooster van mijn studie vinden?"]
 
 # Standard settings
 template_dir = ('interface')
@@ -26,8 +45,9 @@ app.config['SECRET_KEY'] = os.urandom(24)
 socketio = SocketIO(app,  async_handlers=True,
                     async_mode="threading", manage_session=False)
 
-# Store visiting clients together with their main class instance
-clients = {}
+# Runs the conversations of the visiting clients, by their session ID. Every
+# worker makes its own (see serve).
+clients = SessionEngine(socketio)
 
 
 @app.route('/')
@@ -54,8 +74,7 @@ def q(input):
         Input:
             input: str (cleaned by jQuery -> get_input() does it by Python)
     """
-    bot = clients[request.sid]
-    bot[0].get_chatbot().get_input(input)
+    clients.query(request.sid, input)
 
 
 @socketio.on('language')
@@ -65,16 +84,7 @@ def l(lang):
         Input:
             language: lang
     """
-    bot = clients[request.sid][0]
-    C = bot.get_chatbot()
-    V = bot.get_conversation()
-    if lang == 1:
-        C.set_language((lang, 'English'))
-        V.set_main_language((lang, 'English'))
-    else:
-        C.set_language((lang, 'Dutch'))
-        C.set_main_language((lang, 'Dutch'))
-    C.user_set_language()
+    clients.set_language(request.sid, lang)
 
 
 @socketio.on('hackerman')
@@ -82,8 +92,7 @@ def h():
     """
         Someone is trying to put html or something to gerrit
     """
-    bot = clients[request.sid]
-    bot[0].get_chatbot().fool()
+    clients.fool(request.sid)
 
 
 @socketio.on('start')
@@ -97,10 +106,7 @@ def start(methods=['POST']):
     logging.getLogger('werkzeug').setLevel(logging.ERROR)
 
     # Start new chatbot conversation
-    bot = Main(socketio, request.sid)
-    t = Thread(target=bot.run, name=request.sid)
-    clients[request.sid] = (bot, t)
-    t.start()
+    clients.start_session(request.sid)
 
 
 @socketio.on('disconnected')
@@ -109,19 +115,87 @@ def disconnect():
         Remove connection from dictionary
     """
     print("%s Disconnected " % (request.sid) + request.remote_addr)
-    try:
-        bot = clients[request.sid]
-        bot[0].get_chatbot().check_log()
-        bot[1].join()
-        if is_alive(bot[1]):
-            print("Tim stop")
-        else:
-            print("bram boterham")
-        clients = clients.pop(request.sid, None)
-    except:
+    if not clients.end_session(request.sid):
         print("Failed to stop", request.sid)
 
 
+def warm_up():
+    """
+        Load everything that is otherwise loaded by the first conversation:
+        the NLTK tokenizer, tagger and corpora, the knowledge base, the
+        language model, the level and FAQ indexes and the additional and
+        confirmation matchers. Then run the WARM_UP sentences through a Conversation, so
+        the first user does not wait.
+        Output:
+            the time the warm-up took in seconds: float
+    """
+    start = time.time()
+    nltk.word_tokenize("warm up")
+    nltk.pos_tag(["warm", "up"], tagset='universal')
+    knowledge.get_stopwords('dutch')
+    language_detection.get_identifier()
+    level_matching.get_indexes()
+    # Build the FAQ indexes once, before the first conversation needs them
+    search_faq.load_index("extract_site/export_faq_en.txt", "English")
+    search_faq.load_index("extract_site/export_faq_nl.txt", "Dutch")
+    search_additional.load_matcher("additional_en.yml")
+    search_additional.load_matcher("additional_nl.yml")
+    confirmation.load_matcher("core_en.yml")
+    confirmation.load_matcher("core_nl.yml")
+    for sentence in WARM_UP:
+        Conversation(sentence)
+    return time.time() - start
+
+
+def serve(host, port, worker=None):
+    """
+        Run the conversations and the server in this process, until it is
+        stopped
+        Input:
+            host: str
+            port: int
+            worker: the number of this worker, or None without workers
+    """
+    global clients
+    if worker is not None:
+        # The event loop of the sessions can't be shared between processes
+        clients = SessionEngine(socketio)
+        workers.prefix_ids(socketio, worker)
+    # The analysis workers are forked before any thread is started
+    executor.pool.start()
+    # Pick up changes of the FAQ, study and YAML files without a restart
+    resources.Reloader().start()
+    clients.start()
+
+    try:
+        # The same server with and without workers. SocketIO runs in
+        # threading mode, so this is the Werkzeug server, which refuses to
+        # start without a terminal unless allow_unsafe_werkzeug is given. The
+        # Werkzeug reloader would run everything again in a second process;
+        # the files of the resources are reloaded anyway.
+        socketio.run(app, host=host, port=port, debug=True,
+                     use_reloader=False, allow_unsafe_werkzeug=True)
+    finally:
+        executor.pool.stop()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the chatbot server")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="number of worker processes (0: no workers)")
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+
+    # The stored sessions of a previous run can't be continued. The workers
+    # share the directory, so it is cleared here, before they are forked.
+    clients.store.clear()
+
+    # Only accept connections when everything is loaded
+    print("Warming up")
+    print("Ready after %.1f seconds" % warm_up())
+
     # Host to local port
-    socketio.run(app, host='0.0.0.0', debug=True)
+    if args.workers > 0:
+        workers.run(serve, args.workers, port=args.port)
+    else:
+        serve('0.0.0.0', args.port)
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+#
+# File: search_additional.py
+# Matches user input with the questions of an additional YAML database
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# >>> matcher = search_additional.load_matcher("additional_en.yml")
+# >>> matcher.match_sentence(["hi"])
+# >>> matcher.match_keywords({"name"})
+
+# Imports
+import nltk
+
+import knowledge
+import resources
+from config import *
+
+
+class AdditionalMatcher:
+    def __init__(self, conversations, extra=EXTRA_ADDITIONAL):
+        """
+        Compile the questions of an additional database: a hash of the words
+        of every question, and an index of every word to the questions that
+        have it
+
+        Input
+            conversations: list of questions and their answers
+            extra: words that every question is considered to have
+        """
+        self.answers = [x[1] for x in conversations]
+        self.words = [[x.lower() for x in nltk.word_tokenize(x[0])
+                       if x.isalpha()] for x in conversations]
+        self.extra = set(extra)
+
+        # Only the first question with the same words is ever matched
+        self.exact = {}
+        for i, words in enumerate(self.words):
+            self.exact.setdefault(tuple(words), i)
+
+        # Words to the questions that have them, in order
+        self.inverted = {}
+        for i, words in enumerate(self.words):
+            for word in set(words) - self.extra:
+                self.inverted.setdefault(word, []).append(i)
+
+    def __len__(self):
+        return len(self.answers)
+
+    @classmethod
+    def from_file(cls, file):
+        return cls(knowledge.get_yaml(file)['conversations'])
+
+    def match_sentence(self, words):
+        """
+        Input
+            words: list of the words of the sentence
+        Output
+            answer of the first question with the same words, or None
+        """
+        i = self.exact.get(tuple(words))
+        if i is None:
+            return None
+        return self.answers[i]
+
+    def candidates(self, keywords):
+        """
+        Input
+            keywords: set
+        Output
+            sorted list of the questions that have every keyword (or have
+            them in extra)
+        """
+        candidates = None
+        for word in keywords - self.extra:
+            questions = set(self.inverted.get(word, ()))
+            if candidates is None:
+                candidates = questions
+            else:
+                candidates &= questions
+            if not candidates:
+                return []
+        if candidates is None:
+            return list(range(len(self)))
+        return sorted(candidates)
+
+    def match_keywords(self, keywords):
+        """
+        Input
+            keywords: non-empty set
+        Output
+            answer of the first question that has all keywords, or None. It
+            is harder to match small sentences: a sentence of one keyword
+            only matches a question of more than five words with exactly
+            that word.
+        """
+        l = len(keywords)
+        for i in self.candidates(keywords):
+            s = self.words[i]
+            if l == 1 and len(s) > 5:
+                if keywords == set(s) or keywords == set(s) | self.extra:
+                    return self.answers[i]
+            else:
+                return self.answers[i]
+        return None
+
+
+def load_matcher(file):
+    """
+    Get the matcher of an additional database, compiling it only the first
+    time (and again when the database changes)
+
+    Input
+        file: YAML file with 'conversations'
+
+    Output
+        AdditionalMatcher
+    """
+    name = 'additional:' + file
+    # The YAML file is registered first, so it is reloaded first
+    knowledge.get_yaml(file)
+    resources.register(name, lambda: AdditionalMatcher.from_file(file),
+                       [file], depends=['knowledge'])
+    return resources.get(name)
@@ -13,6 +13,7 @@
 import nltk
 import json
 import numpy as np
+import resources
 from config import *
 
 def IDF_table(keywords_list, language):
@@ -41,49 +42,341 @@ def IDF_table(keywords_list, language):
 
     return table
 
-def TF_table(IDF, keywords_list, language):
+class InvertedIndex:
     """
-    This function makes a TF table from an IDF table and the keywords
+    An inverted index from a keyword to the FAQ entries that have it. It is
+    stored in CSR format: the entries of the word in row r are
+    indices[indptr[r]:indptr[r+1]], in increasing order.
+    """
+    def __init__(self, documents, words=None):
+        """
+        Input
+            documents: list of sets of keywords, one for every FAQ entry
+            words: list of all words, in the order of the rows
+        """
+        if words is None:
+            words = sorted(set().union(*documents))
+        self.rows = {word: row for row, word in enumerate(words)}
+        postings = [[] for word in words]
+        for i, document in enumerate(documents):
+            for word in document:
+                postings[self.rows[word]].append(i)
 
-    Input
-        IDF: IDF table created from keywords_list
-        keywords_list: a list of keywords for the IDF table
-        language: language of the conversation
+        self.indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(docs) for docs in postings])
+        self.indices = np.array([i for docs in postings for i in docs],
+                                dtype=np.int64)
 
-    Output
-        TF table of keywords
+    def __contains__(self, word):
+        return word in self.rows
+
+    def query_rows(self, keywords):
+        """
+        Get the rows of the known keywords, once per keyword: the query is a
+        binary vector
+
+        Input
+            keywords: keywords of sentence
+
+        Output
+            array of rows
+        """
+        return np.array([self.rows[word] for word in dict.fromkeys(keywords)
+                         if word in self.rows], dtype=np.int64)
+
+    def positions(self, rows):
+        """
+        Get the positions in indices of all entries of some rows
 
+        Input
+            rows: array of rows
+
+        Output
+            array of positions
+        """
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(self.indptr[row], self.indptr[row + 1])
+                               for row in rows])
+
+    def postings(self, word):
+        """
+        Output
+            array of the FAQ entries with the word
+        """
+        if word not in self.rows:
+            return np.zeros(0, dtype=np.int64)
+        row = self.rows[word]
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def candidates(self, keywords):
+        """
+        Get the FAQ entries that share at least one word with the keywords
+
+        Input
+            keywords: keywords of sentence
+
+        Output
+            sorted array of FAQ entries
+        """
+        return np.unique(self.indices[self.positions(self.query_rows(keywords))])
+
+
+class RankingEngine:
     """
-    TF = []
-    for word in IDF:
-        TF.append([])
-        for keywords in keywords_list:
-            keywords = keywords.split(',')
-            if word in keywords:
-                TF[len(TF)-1].append(1)
-            else:
-                TF[len(TF)-1].append(0)
+    A way of scoring FAQ entries on the postings of an inverted index. An
+    engine weighs all postings once, when the index is built, so a query only
+    adds up the postings of its keywords.
+
+    The score of an entry is
+        sum(data[p]*weights[row(p)] for the postings p of the keywords)
+        / norm(weights[rows of the keywords])
+    """
+    # Name of the engine in config.py
+    name = None
+    # Minimal score of an FAQ entry
+    thresh = FAQ_THRES
+
+    def __init__(self, faq):
+        """
+        Input
+            faq: FAQIndex to weigh the postings of
+        """
+        self.weights = np.ones(len(faq.inverted.rows))
+        self.data = np.ones(len(faq.inverted.indices))
+
+    def norm(self, weights):
+        """
+        Input
+            weights: array of the weights of the keywords
+
+        Output
+            the number the scores are divided by
+        """
+        return np.linalg.norm(weights)
+
+    def score(self, inverted, keywords):
+        """
+        Score the FAQ entries that share a word with the keywords. All other
+        entries have a score of 0 and are not scored, so the cost grows with
+        the number of keywords and not with the size of the FAQ.
+
+        Input
+            inverted: InvertedIndex the engine is built on
+            keywords: keywords of sentence
+
+        Output
+            tuple of a sorted array of FAQ entries and their scores, or None if
+            no keyword is known
+        """
+        rows = inverted.query_rows(keywords)
+        weights = self.weights[rows]
+        norm = self.norm(weights)
+        if norm == 0:
+            return None
+
+        # Sparse matrix-vector product over the rows of the keywords
+        positions = inverted.positions(rows)
+        vector_s = np.repeat(weights, np.diff(inverted.indptr)[rows])
+        candidates, entries = np.unique(inverted.indices[positions],
+                                        return_inverse=True)
+        scores = np.bincount(entries, weights=self.data[positions]*vector_s,
+                             minlength=len(candidates))/norm
+        return candidates, scores
+
+
+class TFIDFEngine(RankingEngine):
+    """
+    Cosine similarity of binary TF vectors weighted by IDF
+    """
+    name = "tfidf"
+    thresh = FAQ_THRES
+
+    def __init__(self, faq):
+        # Precompute the length of every FAQ vector
+        norms = np.array([np.sqrt(sum(faq.IDF[word]**2 for word in set(words)))
+                          for words in faq.documents])
+        norms[norms == 0] = 1
+
+        self.weights = np.array([faq.IDF[word] for word in faq.inverted.rows])
+        self.data = np.repeat(self.weights, np.diff(faq.inverted.indptr)) \
+            / norms[faq.inverted.indices]
 
-    TF = np.matrix(TF)
-    return TF.astype(float)
 
-def cosine_similarity(vector1, vector2, length1):
+class BM25Engine(RankingEngine):
     """
-    Calculates cosine similarity between two vectors
+    Okapi BM25, divided by the sum of the IDF values of the keywords. An FAQ
+    entry of average length that has all keywords then scores 1.
+    """
+    name = "bm25"
+    thresh = BM25_THRES
+
+    def __init__(self, faq, k1=BM25_K1, b=BM25_B):
+        inverted = faq.inverted
+        documents = len(faq.documents)
+        frequencies = np.diff(inverted.indptr)
+        self.weights = np.log((documents - frequencies + 0.5)
+                              / (frequencies + 0.5) + 1)
+
+        # Term frequency and length of the entry of every posting
+        lengths = np.array([len(words) for words in faq.documents], dtype=float)
+        rows = np.repeat(np.arange(len(inverted.rows)), frequencies)
+        words = list(inverted.rows)
+        TF = np.array([faq.documents[entry].count(words[row])
+                       for row, entry in zip(rows, inverted.indices)],
+                      dtype=float)
+        average = np.mean(lengths) if documents else 0
+        ratio = lengths[inverted.indices]/average if average else 1
+        self.data = TF*(k1 + 1)/(TF + k1*(1 - b + b*ratio))
+
+    def norm(self, weights):
+        return np.sum(weights)
+
+
+# The available ranking engines by name
+ENGINES = {engine.name: engine for engine in (TFIDFEngine, BM25Engine)}
+
+
+class FAQIndex:
+    """
+    An index over one FAQ file. It is built once and then answers queries
+    without rebuilding anything: the keywords of the entries are stored in an
+    inverted index, and every ranking engine has weighed its postings.
+    """
+    def __init__(self, datastore, language=None):
+        """
+        Input
+            datastore: dict from comma separated keywords to a question and
+                answer pair (the format of export_faq_*.txt)
+            language: language of the FAQ
+        """
+        self.language = language
+        self.keywords_list = list(datastore.keys())
+        self.questions_answers = [datastore[key] for key in self.keywords_list]
+        self.IDF = IDF_table(self.keywords_list, language)
+        # Entries that may never be given as an answer
+        self.excluded = np.array(['not included' in qa[0]
+                                  for qa in self.questions_answers], dtype=bool)
+
+        self.documents = [keywords.split(',') for keywords in self.keywords_list]
+        self.inverted = InvertedIndex([set(words) for words in self.documents],
+                                      list(self.IDF))
+        self.engines = {name: engine(self) for name, engine in ENGINES.items()}
+
+    @classmethod
+    def from_file(cls, file, language=None):
+        """
+        Build an index from an FAQ file
+
+        Input
+            file: file in specific format where keywords can be extracted from
+            language: language of the FAQ
+
+        Output
+            FAQIndex
+        """
+        with open(file) as f:
+            datastore = json.load(f)
+        return cls(datastore, language)
+
+    def __len__(self):
+        return len(self.keywords_list)
+
+    def similarities(self, keywords, engine=FAQ_ENGINE):
+        """
+        Score the keywords with the FAQ entries that share a word with them
+
+        Input
+            keywords: keywords of sentence
+            engine: name of the ranking engine
+
+        Output
+            tuple of a sorted array of FAQ entries and their scores, or None if
+            no keyword is known
+        """
+        return self.engines[engine].score(self.inverted, keywords)
+
+    def top(self, keywords, asked_questions=(), k=FAQ_MATCHES,
+            thresh=None, engine=FAQ_ENGINE):
+        """
+        Get the best FAQ entries above a threshold, skipping the entries that
+        are already asked or not included
+
+        Input
+            keywords: keywords of sentence
+            asked_questions: already asked questions in string format
+            k: maximum number of entries
+            thresh: minimal score of an entry, by default the threshold of
+                the engine
+            engine: name of the ranking engine
+
+        Output
+            list of the indices of the entries, best first
+        """
+        scored = self.similarities(keywords, engine)
+        if scored is None or k < 1:
+            return []
+        candidates, correlation = scored
+        if thresh is None:
+            thresh = self.engines[engine].thresh
+
+        asked_questions = set(asked_questions)
+        keep = (correlation >= thresh) & ~self.excluded[candidates]
+        keep &= [self.questions_answers[i][0] not in asked_questions
+                 for i in candidates]
+        candidates, correlation = candidates[keep], correlation[keep]
+
+        if len(candidates) > k:
+            best = np.argpartition(-correlation, k - 1)[:k]
+            candidates, correlation = candidates[best], correlation[best]
+        # Highest similarity first, earliest entry first on a tie
+        order = np.lexsort((candidates, -correlation))
+        return candidates[order].tolist()
+
+    def get_entry(self, index):
+        """
+        Output
+            tuple of question and answer in FAQ and the keywords from the
+            question
+        """
+        return (self.questions_answers[index][0],
+                self.questions_answers[index][1], self.keywords_list[index])
+
+
+def load_index(file, language=None):
+    """
+    Get the index of an FAQ file, building it only the first time (and again
+    when the file changes)
 
     Input
-        vector1
-        vector2
-        length1: length of vector1
+        file: file in specific format where keywords can be extracted from
+        language: language of the conversation
 
     Output
-        cosine similarity
+        FAQIndex
+    """
+    name = 'faq:' + file
+    resources.register(name, lambda: FAQIndex.from_file(file, language), [file])
+    return resources.get(name)
 
+def get_faqs(keywords, file, language, asked_questions, matches=FAQ_MATCHES):
+    """
+    get the best results from the FAQ above a threshold
+
+    Input
+        keywords: keywords of sentence
+        file: file in specific format where keywords can be extracted from
+        language: language of the conversation
+        asked_questions: already asked questions in string format
+        matches: maximum number of results
+
+    Output
+        list of tuples of question and answer in FAQ and the keywords from the
+        question, best first
     """
-    if np.sum(vector2) != 0:
-        similarity = np.dot(vector1.T, vector2)[0, 0]/(np.linalg.norm(vector2)*length1)
-        return similarity
-    return 0
+    faq = load_index(file, language)
+    return [faq.get_entry(index)
+            for index in faq.top(keywords, asked_questions, matches)]
 
 def get_faq(keywords, file, language, asked_questions):
     """
@@ -99,44 +392,7 @@ def get_faq(keywords, file, language, asked_questions):
         tuple of question and answer in FAQ and the keywords from the question
         
     """
-    with open(file) as f:
-        datastore = json.load(f)
-    f.close()
-    keywords_list = list(datastore.keys())
-    questions_answers = [datastore[key] for key in keywords_list]
-
-    IDF = IDF_table(keywords_list, language)
-    TF = TF_table(IDF, keywords_list, language)
-    #make TF_vector for keywords
-    word_appearances = []
-
-    for word in IDF:
-        if word in keywords:
-            word_appearances.append(1)
-        else:
-            word_appearances.append(0)
-    #add new vector to the existing TF_table
-    TF = np.c_[TF,  word_appearances]
-    #multiply TF_table by corresponding IDF values
-    counter = 0
-    for word in IDF:
-        TF[counter] = TF[counter]*IDF[word]
-        counter+=1
-    #take the adjusted vector from the sentence
-    vector_s = TF[:, len(keywords_list)]
-    length_s = np.linalg.norm(vector_s)
-    if length_s==0:
-        return None
-    correlation = []
-    #calculate cosine similarity for two vectors
-    for i in range(len(keywords_list)):
-        vector_t = TF[:, i]
-        correlation.append(cosine_similarity(vector_s, vector_t, length_s))
-    #if correlation is above certain value print the question
-    index = np.argmax(correlation)
-    while(questions_answers[index][0] in asked_questions or 'not included' in questions_answers[index][0]):
-        correlation[index] = 0
-        index = np.argmax(correlation)
-    if correlation[index]>=FAQ_THRES:
-        return (questions_answers[index][0], questions_answers[index][1], keywords_list[index])
+    faqs = get_faqs(keywords, file, language, asked_questions, 1)
+    if faqs:
+        return faqs[0]
     return None
@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+#
+# File: sessions.py
+# Runs the conversations of all clients as coroutines in one event loop, in
+# one thread. A conversation that waits for the user costs no thread, and one
+# that waits longer than SESSION_IDLE seconds is stored on disk until the user
+# answers.
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# >>> engine = sessions.SessionEngine(socketio)
+# >>> engine.store.clear()
+# >>> engine.start()
+# >>> engine.start_session(sid)
+# >>> engine.query(sid, {'message': "Hi"})
+# >>> engine.set_language(sid, 1)
+# >>> engine.end_session(sid)
+
+# Imports
+import asyncio
+import os
+import pickle
+import time
+import traceback
+import regex as re
+from threading import Thread
+
+from chatbot import check_log_file
+from main_algorithm import Main
+from config import *
+
+
+class SessionStore:
+    def __init__(self, directory=SESSION_DIR):
+        """
+        Stores waiting conversations in a directory, a file per session
+
+        Input
+            directory: str
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, sid):
+        # Session IDs come from the client, so only keep safe characters
+        return os.path.join(self.directory, re.sub(r"[^\w-]", "_", sid) +
+                            ".pickle")
+
+    def __contains__(self, sid):
+        return os.path.isfile(self.path(sid))
+
+    def save(self, sid, bot):
+        """
+        Input
+            sid: ID of the session
+            bot: Main that waits for the user
+        """
+        # Write to a temporary file first, so a session is never half written
+        temp = self.path(sid) + '.tmp'
+        with open(temp, 'wb') as f:
+            pickle.dump(bot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.path(sid))
+
+    def load(self, sid):
+        """
+        Load a stored conversation and remove it from the store
+
+        Input
+            sid: ID of the session
+        Output
+            Main, which still needs to be attached to the socket
+        """
+        with open(self.path(sid), 'rb') as f:
+            bot = pickle.load(f)
+        self.delete(sid)
+        return bot
+
+    def delete(self, sid):
+        try:
+            os.remove(self.path(sid))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """
+        Remove all stored sessions, like the ones of a previous run
+        """
+        for file in os.listdir(self.directory):
+            if file.endswith(".pickle") or file.endswith(".pickle.tmp"):
+                os.remove(os.path.join(self.directory, file))
+
+
+class SessionEngine(Thread):
+    def __init__(self, socket, log=True, idle=SESSION_IDLE,
+                 directory=SESSION_DIR):
+        """
+        The event loop of all conversations. The socket handlers call it
+        from their own threads, and all sessions are changed in the loop.
+
+        Input
+            socket: Flask SocketIO object
+            log: whether conversations are written to log files
+            idle: seconds after which a waiting conversation is stored
+            directory: where the waiting conversations are stored
+        """
+        Thread.__init__(self, name="sessions", daemon=True)
+        self.socket = socket
+        self.log = log
+        self.idle = idle
+        self.loop = asyncio.new_event_loop()
+        # The Main and the task of every session in memory by its ID
+        self.sessions = {}
+        # The time of the last input of every session in memory
+        self.active = {}
+        # Stores the sessions that wait too long. The worker processes share
+        # its directory, so it is cleared once before they are forked.
+        self.store = SessionStore(directory)
+        # The log file of every stored session, to check it when the session
+        # ends without loading it
+        self.logs = {}
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self.offload())
+        self.loop.run_forever()
+
+    def call(self, coroutine):
+        """
+        Run a coroutine in the event loop and wait for its result
+
+        Input
+            coroutine: coroutine
+        Output
+            the result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def create_session(self, sid):
+        """
+        Create a Main in the event loop and start its conversation
+
+        Input
+            sid: ID of the session
+        Output
+            Main
+        """
+        bot = Main(self.socket, sid, log=self.log)
+        self.resume(sid, bot)
+        return bot
+
+    def resume(self, sid, bot):
+        """
+        Run the conversation of a session in the event loop
+        """
+        task = self.loop.create_task(self.converse(sid, bot))
+        self.sessions[sid] = (bot, task)
+        self.active[sid] = time.monotonic()
+
+    async def converse(self, sid, bot):
+        """
+        Run the conversation of a session until it is finished or ended
+        """
+        try:
+            await bot.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            traceback.print_exc()
+        finally:
+            if sid in self.sessions and self.sessions[sid][0] is bot:
+                del self.sessions[sid]
+                del self.active[sid]
+
+    async def find_session(self, sid):
+        """
+        Get the Main of a session, loading it if it was stored. Every access
+        counts as activity, so the session is not stored right after it.
+
+        Input
+            sid: ID of the session
+        Output
+            Main, or None if the session is unknown or its conversation
+            is finished
+        """
+        if sid not in self.sessions and sid in self.store:
+            bot = self.store.load(sid)
+            self.logs.pop(sid, None)
+            bot.attach(self.socket)
+            self.resume(sid, bot)
+        if sid not in self.sessions:
+            return None
+        self.active[sid] = time.monotonic()
+        return self.sessions[sid][0]
+
+    async def deliver(self, sid, message):
+        bot = await self.find_session(sid)
+        if bot is None:
+            print("Ignored a message for", sid, "which has no conversation")
+            return
+        bot.get_chatbot().get_input(message)
+
+    async def change_language(self, sid, lang):
+        bot = await self.find_session(sid)
+        if bot is not None:
+            bot.set_language(lang)
+
+    async def mark_fooled(self, sid):
+        bot = await self.find_session(sid)
+        if bot is not None:
+            bot.get_chatbot().fool()
+
+    async def stop_session(self, sid):
+        """
+        Stop the conversation of a session. A stored conversation is removed
+        without loading it.
+
+        Input
+            sid: ID of the session
+        Output
+            bool: whether the session had a conversation
+        """
+        if sid in self.sessions:
+            bot, task = self.sessions.pop(sid)
+            del self.active[sid]
+            bot.get_chatbot().check_log()
+            task.cancel()
+            return True
+        if sid in self.store:
+            self.store.delete(sid)
+            file = self.logs.pop(sid, None)
+            if file is not None:
+                check_log_file(file)
+            return True
+        return False
+
+    def offload_idle(self):
+        """
+        Store the conversations that waited for the user longer than idle
+        seconds, and remove them from memory
+
+        Output
+            list of the IDs of the stored sessions
+        """
+        stored = []
+        now = time.monotonic()
+        for sid, (bot, task) in list(self.sessions.items()):
+            # A conversation without a state is between two questions
+            if now - self.active[sid] < self.idle or bot.state is None or \
+                    not bot.get_chatbot().inputs.empty():
+                continue
+            try:
+                self.store.save(sid, bot)
+            except Exception:
+                traceback.print_exc()
+                continue
+            del self.sessions[sid]
+            del self.active[sid]
+            task.cancel()
+            file = bot.get_chatbot().get_log_file()
+            if file is not None:
+                self.logs[sid] = file
+            stored.append(sid)
+        return stored
+
+    async def offload(self):
+        """
+        Check for idle conversations every quarter of idle seconds
+        """
+        while True:
+            await asyncio.sleep(self.idle/4)
+            stored = self.offload_idle()
+            if stored:
+                print("Stored", len(stored), "idle sessions")
+
+    def start_session(self, sid):
+        """
+        Start the conversation of a new session
+
+        Input
+            sid: ID of the session
+        Output
+            Main
+        """
+        return self.call(self.create_session(sid))
+
+    def __contains__(self, sid):
+        return sid in self.sessions or sid in self.store
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def set_language(self, sid, lang):
+        """
+        Change the language of the conversation of a session, in the event
+        loop
+
+        Input
+            sid: ID of the session
+            lang: 1 for English, otherwise Dutch
+        """
+        self.call(self.change_language(sid, lang))
+
+    def fool(self, sid):
+        """
+        Remember that the user of a session tried to send HTML
+
+        Input
+            sid: ID of the session
+        """
+        self.call(self.mark_fooled(sid))
+
+    def query(self, sid, message):
+        """
+        Give input of the user to the conversation of a session, which
+        continues in the event loop
+
+        Input
+            sid: ID of the session
+            message: dict with the 'message' of the user
+        """
+        self.call(self.deliver(sid, message))
+
+    def end_session(self, sid):
+        """
+        Stop the conversation of a session
+
+        Input
+            sid: ID of the session
+        Output
+            bool: whether the session had a conversation
+        """
+        return self.call(self.stop_session(sid))
@@ -0,0 +1,442 @@
+#!/usr/bin/python3
+#
+# File: workers.py
+# Runs the chatbot in several worker processes behind one front process. The
+# workers are forked after warming up, so they share the knowledge base and
+# the indexes with copy-on-write, and the front process routes every request
+# of a session to the worker of that session.
+# Copyright 2018
+# The Gerrit Group
+#
+
+# Usage
+# >>> workers.run(serve, 4, port=5000)
+# where serve(host, port, worker) runs the server of one worker
+# ~ python3 workers.py
+# Tests the routing of the front process with two fake workers.
+
+# Imports
+import asyncio
+import gc
+import itertools
+import os
+import signal
+import sys
+import traceback
+import regex as re
+
+from config import *
+
+# Bytes that are copied at once between a client and its worker
+BUFFER = 2**16
+
+# The session ID in the query of a Socket.IO request
+SID = re.compile(rb"[?&]sid=(\d+)\.")
+
+
+def prefix_ids(socketio, worker):
+    """
+    Start every session ID of a worker with its number, like "2.xq3f...", so
+    the front process knows which worker has the session
+
+    Input
+        socketio: Flask SocketIO object
+        worker: int
+    """
+    eio = socketio.server.eio
+    generate_id = eio.generate_id
+    eio.generate_id = lambda: "%d.%s" % (worker, generate_id())
+
+
+def worker_of(head):
+    """
+    Input
+        head: the first line and the headers of an HTTP request: bytes
+    Output
+        the number of the worker of the session of the request, or None if
+        the request starts a new session (or is not for a session)
+    """
+    found = SID.search(head.split(b"\r\n", 1)[0])
+    if found is None:
+        return None
+    return int(found.group(1))
+
+
+def headers_of(head):
+    """
+    Input
+        head: the first line and the headers of an HTTP message: bytes
+    Output
+        dict of the lowercase names of the headers to their lowercase values
+    """
+    headers = {}
+    for line in head.split(b"\r\n")[1:]:
+        name, colon, value = line.partition(b":")
+        if colon:
+            headers[name.strip().lower().decode('latin-1')] = \
+                value.strip().lower().decode('latin-1')
+    return headers
+
+
+def closing(head):
+    """
+    Input
+        head: the first line and the headers of an HTTP request: bytes
+    Output
+        the head with "Connection: close", so the worker closes the
+        connection after its response
+    """
+    lines = [line for line in head.split(b"\r\n") if line and not
+             line.lower().startswith((b"connection:", b"keep-alive:"))]
+    return b"\r\n".join(lines + [b"Connection: close", b"", b""])
+
+
+def keep_alive(request, response):
+    """
+    Whether the connection with the client can be used for its next request
+
+    Input
+        request: the first line and the headers of the request: bytes
+        response: the whole response of the worker: bytes
+    """
+    head = response.split(b"\r\n\r\n", 1)[0]
+    asked, given = headers_of(request), headers_of(head)
+    return (request.split(b"\r\n", 1)[0].endswith(b"HTTP/1.1") and
+            asked.get('connection') != 'close' and
+            given.get('connection') != 'close' and
+            ('content-length' in given or
+             given.get('transfer-encoding') == 'chunked'))
+
+
+async def pipe(reader, writer):
+    """
+    Copy everything from a reader to a writer, until the reader is closed
+    """
+    try:
+        while True:
+            data = await reader.read(BUFFER)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        pass
+
+
+class Front:
+    def __init__(self, ports, host="127.0.0.1"):
+        """
+        Routes every request to a worker: a request of a session goes to the
+        worker of that session, a request that starts a session goes to the
+        next worker, so the sessions are spread over the workers. A client
+        may send requests of several sessions over one connection, so every
+        request is sent to its worker over a new connection.
+
+        Input
+            ports: list of the ports of the workers
+            host: the host of the workers
+        """
+        self.ports = ports
+        self.host = host
+        self.next_session = itertools.cycle(range(len(ports)))
+        # Requests for the page and its images can go to any worker
+        self.next_request = itertools.cycle(range(len(ports)))
+        # The number of sessions started at every worker
+        self.sessions = [0] * len(ports)
+
+    def route(self, head):
+        """
+        Input
+            head: the first line and the headers of an HTTP request: bytes
+        Output
+            the number of the worker for the request
+        """
+        worker = worker_of(head)
+        if worker is not None and 0 <= worker < len(self.ports):
+            return worker
+        if b"/socket.io/" in head.split(b"\r\n", 1)[0]:
+            worker = next(self.next_session)
+            self.sessions[worker] += 1
+            return worker
+        return next(self.next_request)
+
+    async def forward(self, worker, head, body):
+        """
+        Send one request to a worker
+
+        Input
+            worker: int
+            head: the first line and the headers of the request: bytes
+            body: bytes
+        Output
+            the whole response of the worker: bytes
+        """
+        reader, writer = await asyncio.open_connection(self.host,
+                                                       self.ports[worker])
+        try:
+            writer.write(closing(head) + body)
+            await writer.drain()
+            response = await reader.readuntil(b"\r\n\r\n")
+            length = headers_of(response).get('content-length')
+            if head.startswith(b"HEAD "):
+                pass
+            elif length is not None:
+                response += await reader.readexactly(int(length))
+            else:
+                # The worker closes the connection after the body
+                response += await reader.read()
+        finally:
+            writer.close()
+        return response
+
+    async def tunnel(self, worker, head, reader, writer):
+        """
+        Connect the rest of a connection to a worker, for a WebSocket (which
+        belongs to one session) or a request of unknown length
+        """
+        worker_reader, worker_writer = await asyncio.open_connection(
+            self.host, self.ports[worker])
+        worker_writer.write(head)
+        to_worker = asyncio.ensure_future(pipe(reader, worker_writer))
+        # The worker closes the connection when it is done
+        await pipe(worker_reader, writer)
+        to_worker.cancel()
+        worker_writer.close()
+
+    async def handle(self, reader, writer):
+        """
+        Route the requests of a client to their workers, until the client
+        or the worker closes the connection
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                headers = headers_of(head)
+                worker = self.route(head)
+                if 'upgrade' in headers or 'transfer-encoding' in headers:
+                    await self.tunnel(worker, head, reader, writer)
+                    break
+                body = await reader.readexactly(
+                    int(headers.get('content-length', 0)))
+                response = await self.forward(worker, head, body)
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive(head, response):
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """
+        Accept clients until the process is stopped
+
+        Input
+            host: str
+            port: int
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        stop = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        async with server:
+            await stop.wait()
+
+
+def fork(serve, workers, host, port):
+    """
+    Start the worker processes. Everything loaded before is shared with them
+    until one of them changes it.
+
+    Input
+        serve: function(host, port, worker) that runs the server of a worker
+        workers: the number of workers
+        host: the host the workers listen on
+        port: the port of the front process, worker i listens on port + 1 + i
+    Output
+        list of the process IDs of the workers
+    """
+    # Objects that exist now are never moved by the garbage collector, so
+    # collecting does not copy the pages they are on into every worker
+    gc.collect()
+    gc.freeze()
+    pids = []
+    for worker in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Stop like on an exception when the front process stops, so the
+            # worker can clean up
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            try:
+                serve(host, port + 1 + worker, worker)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    return pids
+
+
+def run(serve, workers=WORKERS, host='0.0.0.0', port=PORT):
+    """
+    Fork the workers and route the clients to them, until the process is
+    stopped. Call this after warming up, so the workers share what is loaded.
+
+    Input
+        serve: function(host, port, worker) that runs the server of a worker
+        workers: the number of workers
+        host: the host the clients connect to
+        port: the port the clients connect to
+    """
+    pids = fork(serve, workers, "127.0.0.1", port)
+    front = Front([port + 1 + worker for worker in range(workers)])
+    print("Routing port %d to %d workers, with %d analysis processes in "
+          "total" % (port, workers, workers*ANALYSIS_WORKERS))
+    try:
+        asyncio.run(front.serve(host, port))
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        print("Sessions per worker:", front.sessions)
+
+
+def fake_worker(host, port, worker):
+    """
+    A server like a worker that answers every request with its number and the
+    session ID, and echoes its number over a WebSocket, for the test
+    """
+    sessions = itertools.count()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = headers_of(head)
+                await reader.readexactly(int(headers.get('content-length', 0)))
+                if 'upgrade' in headers:
+                    writer.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                                 b"Upgrade: websocket\r\n"
+                                 b"Connection: Upgrade\r\n\r\n")
+                    while await reader.readline():
+                        writer.write(b"%d\n" % worker)
+                    break
+                found = re.search(rb"[?&]sid=([^& ]+)",
+                                  head.split(b"\r\n", 1)[0])
+                sid = b"%d.%d" % (worker, next(sessions)) if found is None \
+                    else found.group(1)
+                body = b"%d %s" % (worker, sid)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n"
+                             b"\r\n%s" % (len(body), body))
+                await writer.drain()
+                if headers.get('connection') == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def test(clients=10, turns=5, port=PORT):
+    """
+    Run sessions through a front process to two fake workers. Two sessions
+    share every connection, and every session ends with a WebSocket. Checks
+    that every request of a session reaches the worker of its session ID,
+    and that the sessions are spread over the workers.
+    """
+    async def close(reader, writer):
+        # Wait until the front process closed the connection too
+        writer.write_eof()
+        await reader.read()
+        writer.close()
+
+    async def request(reader, writer, line):
+        writer.write(line + b" HTTP/1.1\r\nHost: test\r\n\r\n")
+        head = await reader.readuntil(b"\r\n\r\n")
+        body = await reader.readexactly(
+            int(headers_of(head)['content-length']))
+        worker, sid = body.split()
+        return int(worker), sid
+
+    async def websocket(sid):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /socket.io/?EIO=4&transport=websocket&sid=%s "
+                     b"HTTP/1.1\r\nHost: test\r\nUpgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\n\r\n" % sid)
+        await reader.readuntil(b"\r\n\r\n")
+        workers = []
+        for _ in range(turns):
+            writer.write(b"ping\n")
+            workers.append(int(await reader.readline()))
+        await close(reader, writer)
+        return workers
+
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        sids = []
+        for _ in range(2):
+            worker, sid = await request(reader, writer, b"GET "
+                                        b"/socket.io/?EIO=4&transport=polling")
+            assert sid.startswith(b"%d." % worker)
+            sids.append(sid)
+        for _ in range(turns):
+            for sid in sids:
+                for method in (b"POST", b"GET"):
+                    worker, found = await request(
+                        reader, writer, method +
+                        b" /socket.io/?EIO=4&transport=polling&sid=" + sid)
+                    assert (worker, found) == (int(sid.split(b".")[0]), sid)
+        await close(reader, writer)
+        for sid in sids:
+            assert set(await websocket(sid)) == {int(sid.split(b".")[0])}
+        return sids
+
+    async def main(front):
+        server = await asyncio.start_server(front.handle, "127.0.0.1", port)
+        async with server:
+            # Wait until the workers accept connections
+            for worker_port in front.ports:
+                while True:
+                    try:
+                        _, writer = await asyncio.open_connection(
+                            "127.0.0.1", worker_port)
+                        writer.close()
+                        break
+                    except OSError:
+                        await asyncio.sleep(0.05)
+            return await asyncio.gather(*[client() for _ in range(clients)])
+
+    pids = fork(fake_worker, 2, "127.0.0.1", port)
+    front = Front([port + 1, port + 2])
+    try:
+        sids = asyncio.run(main(front))
+    finally:
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+    assert front.sessions == [clients, clients]
+    print("%d sessions routed to their worker, sessions per worker: %s" %
+          (2*clients, front.sessions))
+
+
+# Simple test
+if __name__ == "__main__":
+    test()